@@ -0,0 +1,28 @@
+# Gunicorn configuration for serving the proxy in production
+#
+#   gunicorn -c config/gunicorn.conf.py src.proxy:app
+#
+# Each worker process lazily starts its own html_processing event loop, so
+# LLM calls from all of a worker's threads share one loop and one client.
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# Threads absorb the wait on Wikipedia and Claude; processes add CPU for lxml
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '16'))
+
+# Rewriting a long article can take well over the 30s default
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '300'))
+keepalive = 30
+
+accesslog = '-'
+
+
+def post_worker_init(worker):
+    """Configure the proxy's own loggers, which gunicorn leaves untouched"""
+    from src.proxy import configure_logging
+    configure_logging()
@@ -1,12 +1,21 @@
 import re
 import os
+import json
+import logging
 import asyncio
+import atexit
+import itertools
+import threading
+import weakref
 import time
-from bs4 import BeautifulSoup, NavigableString
+import lxml.etree
+import lxml.html
 from typing import Optional
 from src import llm
 
 
+logger = logging.getLogger(__name__)
+
 WEBSITE_DOMAIN = os.getenv("WEBSITE_DOMAIN", "localhost:8000")
 
 # Thresholds for section processing
@@ -17,14 +26,74 @@ SMALL_SECTION_THRESHOLD = 2500  # Batch sections with < 2500 chars (configurable
 if os.environ.get('SMALL_SECTION_THRESHOLD'):
     SMALL_SECTION_THRESHOLD = int(os.environ.get('SMALL_SECTION_THRESHOLD'))
 
+# Max concurrent LLM calls across all pages on an event loop (configurable via env)
+LLM_CONCURRENCY = int(os.environ.get('LLM_CONCURRENCY', '8'))
+
+# Send each page's sections as one Message Batch instead of interactive calls.
+# Half the cost but minutes of latency, so only for offline reprocessing.
+LLM_BATCH_MODE = os.environ.get('LLM_BATCH_MODE', 'false').lower() == 'true'
+
+# One LLM semaphore per event loop; a semaphore must not be shared across loops
+_llm_semaphores = weakref.WeakKeyDictionary()
+
+# Long-lived event loop shared by all requests, started on first use
+_processing_loop = None
+_processing_loop_lock = threading.Lock()
+
 # Section headings to skip (case-insensitive)
-SKIP_SECTIONS = {
+SKIP_SECTIONS = frozenset({
     'references', 'notes', 'bibliography', 'citations', 'footnotes',
     'external links', 'see also', 'further reading',
     'sources', 'works cited', 'general references',
     'general bibliography', 'selected bibliography'
+})
+
+# URL rewriting: a single alternation so the page is scanned once.
+# Wikimedia comes first so it is never shadowed by the shorter patterns.
+# Patterns and replacements are ASCII, so they run directly on the raw bytes.
+_URL_RE = re.compile(
+    rb'(?P<wikimedia>https?://upload\.wikimedia\.org)'
+    rb'|(?P<wiki>https?://(?:[a-z]+\.)?wikipedia\.org)'
+    rb'|(?P<proto>//(?:[a-z]+\.)?wikipedia\.org)'
+)
+
+# Separator between sections in a batched LLM request/response
+_SECTION_BREAK_RE = re.compile(r'<!-- SECTION_BREAK_\d+ -->')
+
+# lxml parsers for pages and rewritten fragments, one per thread: a parser
+# instance can only be used by one thread at a time, and pages are parsed in
+# worker threads while fragments are parsed on the event loop thread.
+_parsers = threading.local()
+
+# Proxy replacement targets, keyed by the group name that matched
+_PROXY_DOMAINS = {
+    'wikimedia': f"http://{WEBSITE_DOMAIN}/wikimedia".encode('utf-8'),
+    'wiki': f"http://{WEBSITE_DOMAIN}".encode('utf-8'),
+    'proto': f"//{WEBSITE_DOMAIN}".encode('utf-8'),
 }
 
+
+def get_html_parser() -> lxml.html.HTMLParser:
+    """Get or create this thread's lxml HTML parser"""
+    parser = getattr(_parsers, 'parser', None)
+    if parser is None:
+        # Wikipedia always serves UTF-8; without the encoding lxml would guess it for raw bytes
+        parser = _parsers.parser = lxml.html.HTMLParser(
+            encoding='utf-8', remove_comments=False, remove_blank_text=False
+        )
+    return parser
+
+
+def parse_page(content: bytes):
+    """Parse a UTF-8 encoded page with the calling thread's parser"""
+    return lxml.html.document_fromstring(content, parser=get_html_parser())
+
+
+def _replace_url(match) -> bytes:
+    """Return the proxy replacement for a matched Wikipedia/Wikimedia URL"""
+    return _PROXY_DOMAINS[match.lastgroup]
+
+
 def rewrite_urls(content: bytes, content_type: Optional[str]) -> bytes:
     """
     Rewrite URLs in HTML content to go through the proxy.
@@ -36,57 +105,97 @@ def rewrite_urls(content: bytes, content_type: Optional[str]) -> bytes:
     Returns:
         Content with rewritten URLs
     """
-
-    base_domain = f"http://{WEBSITE_DOMAIN}"
-    protocol_domain = f"//{WEBSITE_DOMAIN}"
-    wikimedia_domain = f"http://{WEBSITE_DOMAIN}/wikimedia"
-
-    if not content_type or 'text/html' not in content_type:
+    if not content_type or not content_type.startswith('text/html'):
         return content
 
-    html = content.decode('utf-8')
-
-    # Replace Wikipedia domain URLs with proxy URLs
-    html = re.sub(
-        r'https?://([a-z]+\.)?wikipedia\.org',
-        base_domain,
-        html
-    )
+    # Every pattern ends in one of these domains; substring searches are much
+    # cheaper than running the regex over a page with nothing to replace.
+    # (A bare b'wiki' probe would match every relative /wiki/ link.)
+    if b'wikipedia.org' not in content and b'wikimedia.org' not in content:
+        return content
 
-    # Handle protocol-relative URLs
-    html = re.sub(
-        r'//([a-z]+\.)?wikipedia\.org',
-        protocol_domain,
-        html
-    )
+    # Replace Wikipedia, protocol-relative and Wikimedia URLs in one pass
+    return _URL_RE.sub(_replace_url, content)
 
-    # Replace Wikimedia URLs
-    html = re.sub(
-        r'https?://upload\.wikimedia\.org',
-        wikimedia_domain,
-        html
-    )
 
-    return html.encode('utf-8')
+def is_heading_div(element) -> bool:
+    """Check whether an lxml element is a Wikipedia section heading div"""
+    return element.tag == 'div' and 'mw-heading' in (element.get('class') or '').split()
 
 
 def get_section_heading_text(heading_div) -> str:
     """Extract text from a heading div"""
-    if not heading_div:
+    if heading_div is None:
         return ""
-    h_tag = heading_div.find(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
-    if h_tag:
-        return h_tag.get_text(strip=True).lower()
+    for h_tag in heading_div.iter('h1', 'h2', 'h3', 'h4', 'h5', 'h6'):
+        return h_tag.text_content().strip().lower()
     return ""
 
 
-def should_skip_section(heading_text: str, html_content: str) -> bool:
+def elements_to_html(leading_text: Optional[str], elements: list) -> str:
+    """Serialize a run of sibling elements (including their tails) to HTML"""
+    # etree.tostring skips the argument handling lxml.html.tostring layers on top
+    return (leading_text or '') + ''.join(
+        lxml.etree.tostring(elem, method='html', encoding='unicode') for elem in elements
+    )
+
+
+def text_length(leading_text: Optional[str], elements: list) -> int:
+    """
+    Count the stripped text characters in a run of sibling elements.
+
+    Walks the already-parsed nodes instead of re-parsing the serialized HTML.
+    Comment contents are ignored, their tail text is not.
+    """
+    length = len(leading_text.strip()) if leading_text else 0
+    for elem in elements:
+        if isinstance(elem.tag, str):
+            length += sum(len(text.strip()) for text in elem.itertext())
+        if elem.tail:
+            length += len(elem.tail.strip())
+    return length
+
+
+def splice_section(parent, anchor, old_elements: list, updated_html: str):
+    """
+    Replace a section's elements in the tree with freshly parsed HTML.
+
+    Args:
+        parent: The element containing the section (mw-parser-output div)
+        anchor: The heading div the section follows, or None for the intro
+        old_elements: The section's current elements, removed from parent
+        updated_html: The HTML to parse and insert in their place
+    """
+    fragments = lxml.html.fragments_fromstring(updated_html, parser=get_html_parser())
+    leading_text = ''
+    first = 0
+    if fragments and isinstance(fragments[0], str):
+        leading_text = fragments[0]
+        first = 1
+
+    for elem in old_elements:
+        parent.remove(elem)
+
+    if anchor is None:
+        parent.text = leading_text
+        for position, fragment in enumerate(itertools.islice(fragments, first, None)):
+            parent.insert(position, fragment)
+    else:
+        # fragments_fromstring already returns a list: link each node in
+        # after the previous one without copying or reversing it
+        anchor.tail = leading_text
+        for fragment in itertools.islice(fragments, first, None):
+            anchor.addnext(fragment)
+            anchor = fragment
+
+
+def should_skip_section(heading_text: str, text_length: int) -> bool:
     """
     Determine if a section should be skipped entirely.
 
     Args:
         heading_text: The heading text (lowercase)
-        html_content: The HTML content of the section
+        text_length: Number of text characters in the section
 
     Returns:
         True if section should be skipped, False otherwise
@@ -96,10 +205,7 @@ def should_skip_section(heading_text: str, html_content: str) -> bool:
         return True
 
     # Skip if content is tiny (< 50 chars of actual text)
-    from bs4 import BeautifulSoup
-    soup = BeautifulSoup(html_content, 'html.parser')
-    text_content = soup.get_text(strip=True)
-    if len(text_content) < TINY_SECTION_THRESHOLD:
+    if text_length < TINY_SECTION_THRESHOLD:
         return True
 
     return False
@@ -116,35 +222,46 @@ def split_batch_result(combined_html: str, num_sections: int) -> list:
     Returns:
         List of individual section HTML strings
     """
-    sections = []
-    for i in range(num_sections):
-        separator = f"<!-- SECTION_BREAK_{i} -->"
-        if separator in combined_html:
-            if i == 0:
-                # First section: everything before first separator
-                parts = combined_html.split(separator, 1)
-                sections.append(parts[0])
-            else:
-                # Find content between previous and current separator
-                prev_separator = f"<!-- SECTION_BREAK_{i-1} -->"
-                if prev_separator in combined_html:
-                    start_idx = combined_html.find(prev_separator) + len(prev_separator)
-                    end_idx = combined_html.find(separator)
-                    sections.append(combined_html[start_idx:end_idx])
-        elif i == num_sections - 1:
-            # Last section: everything after last separator
-            last_separator = f"<!-- SECTION_BREAK_{i-1} -->"
-            if last_separator in combined_html:
-                parts = combined_html.split(last_separator, 1)
-                if len(parts) > 1:
-                    sections.append(parts[1])
-
-    return sections
-
-
-async def update_content(html_blob):
+    # One linear split on any marker, stopping once every section is found;
+    # stray trailing content is discarded
+    return _SECTION_BREAK_RE.split(combined_html, maxsplit=num_sections)[:num_sections]
+
+
+def parse_batch_result(combined_html: str, num_sections: int) -> list:
+    """
+    Parse a batched LLM result into individual sections.
+
+    The LLM is asked for a JSON array of {"i": index, "html": ...} objects;
+    if the reply is not valid JSON, fall back to the SECTION_BREAK markers.
+
+    Args:
+        combined_html: The combined response from LLM
+        num_sections: Number of sections that were batched
+
+    Returns:
+        List of individual section HTML strings
+    """
+    start = combined_html.find('[')
+    end = combined_html.rfind(']')
+    if start != -1 and end > start:
+        try:
+            items = json.loads(combined_html[start:end + 1])
+            by_index = {item['i']: item['html'] for item in items}
+            return [by_index[i] for i in range(num_sections)]
+        except (ValueError, TypeError, KeyError):
+            pass
+
+    return split_batch_result(combined_html, num_sections)
+
+
+async def update_content(html_blob, num_sections=1):
     """Async wrapper for LLM rewrite_content"""
-    return await llm.rewrite_content(html_blob)
+    return await llm.rewrite_content(html_blob, num_sections)
+
+
+async def update_content_batch(html_blobs: list, num_sections: list) -> list:
+    """Async wrapper for LLM rewrite_content_batch (None where a request failed)"""
+    return await llm.rewrite_content_batch(html_blobs, num_sections)
 
 
 async def process_section(section):
@@ -157,76 +274,80 @@ async def process_section(section):
     }
 
 
-async def process_and_replace_sections_inline(html):
+def get_llm_semaphore() -> asyncio.Semaphore:
+    """Get or create the semaphore limiting LLM calls on the running event loop"""
+    loop = asyncio.get_running_loop()
+    semaphore = _llm_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _llm_semaphores[loop] = asyncio.Semaphore(LLM_CONCURRENCY)
+    return semaphore
+
+
+def plan_rewrite(tree) -> tuple:
     """
-    Extract sections, process them in parallel with async LLM, and replace inline.
-    Uses optimized approach: extract, filter/batch, async parallel process, reconstruct.
+    Extract a page's sections and group them into LLM tasks (batch or individual).
 
     Args:
-        html: Original HTML string
+        tree: Parsed lxml document
 
     Returns:
-        Modified HTML string
+        Tuple of (content_div, sections, process_tasks)
     """
-    soup = BeautifulSoup(html, 'lxml')
-
-    # Find the correct mw-parser-output div
-    mw_content_text = soup.find('div', id='mw-content-text')
-    if not mw_content_text:
+    # Find the correct mw-parser-output div. Both lookups stop at the first
+    # match instead of collecting matches from the whole document.
+    mw_content_text = tree.find('.//div[@id="mw-content-text"]')
+    if mw_content_text is None:
         raise Exception("mw-content-text div not found!")
 
-    content_div = mw_content_text.find('div', class_='mw-parser-output')
-    if not content_div:
-        raise Exception("Main content div (mw-parser-output) not found inside mw-content-text!")
+    # The parser output is normally a direct child; only search deeper if not
+    content_div = next(
+        (child for child in mw_content_text
+         if child.tag == 'div' and 'mw-parser-output' in child.get('class', '').split()),
+        None
+    )
+    if content_div is None:
+        parser_outputs = mw_content_text.find_class('mw-parser-output')
+        if not parser_outputs:
+            raise Exception("Main content div (mw-parser-output) not found inside mw-content-text!")
+        content_div = parser_outputs[0]
 
     # ==================== PHASE 1: EXTRACT ALL SECTIONS ====================
-    sections = []
+    # Partition the content div's children in a single pass: bucket 0 is the
+    # introduction, every heading div starts a new bucket.
+    headings = [None]
+    buckets = [[]]
+    for child in content_div:
+        if is_heading_div(child):
+            headings.append(child)
+            buckets.append([])
+        else:
+            buckets[-1].append(child)
 
-    # 1. Extract introduction
-    intro_elements = []
-    first_heading_div = None
-    for child in content_div.children:
-        if child.name == 'div' and child.get('class') and 'mw-heading' in child.get('class'):
-            first_heading_div = child
-            break
-        intro_elements.append(child)
-
-    intro_html = ''.join(str(elem) for elem in intro_elements)
-    intro_text_len = len(BeautifulSoup(intro_html, 'html.parser').get_text(strip=True))
-
-    sections.append({
-        'index': 0,
-        'type': 'intro',
-        'html': intro_html,
-        'heading_text': '',
-        'text_length': intro_text_len,
-        'insert_before': first_heading_div,
-        'elements_to_remove': intro_elements
-    })
-
-    # 2. Extract all h2 sections
-    heading_divs = content_div.find_all('div', class_='mw-heading')
-    for idx, heading_div in enumerate(heading_divs, start=1):
-        section_elements = []
-
-        # Collect elements until next heading div
-        for sibling in heading_div.find_next_siblings():
-            if sibling.name == 'div' and sibling.get('class') and 'mw-heading' in sibling.get('class'):
-                break
-            section_elements.append(sibling)
-
-        section_html = ''.join(str(elem) for elem in section_elements)
+    sections = []
+    for idx, (heading_div, section_elements) in enumerate(zip(headings, buckets)):
+        # Text right after the heading (or at the start of the div) belongs to the section
+        leading_text = content_div.text if heading_div is None else heading_div.tail
         heading_text = get_section_heading_text(heading_div)
-        text_len = len(BeautifulSoup(section_html, 'html.parser').get_text(strip=True))
+        # Skipped sections stay in the tree as they are, so they are never
+        # serialized and have nothing to remove. Skip-listed headings are
+        # checked first: reference lists are often the longest text on the
+        # page and their length is never needed.
+        if heading_text in SKIP_SECTIONS:
+            section_length = 0
+            skip = True
+        else:
+            section_length = text_length(leading_text, section_elements)
+            skip = should_skip_section(heading_text, section_length)
 
         sections.append({
             'index': idx,
-            'type': 'section',
-            'html': section_html,
+            'type': 'intro' if heading_div is None else 'section',
+            'html': None if skip else elements_to_html(leading_text, section_elements),
             'heading_text': heading_text,
-            'text_length': text_len,
+            'text_length': section_length,
+            'skip': skip,
             'insert_after': heading_div,
-            'elements_to_remove': section_elements
+            'elements_to_remove': [] if skip else section_elements
         })
 
     # ==================== PHASE 1.5: FILTER AND BATCH SECTIONS ====================
@@ -236,7 +357,7 @@ async def process_and_replace_sections_inline(html):
     large_indices = []
 
     for i, section in enumerate(sections):
-        if should_skip_section(section['heading_text'], section['html']):
+        if section['skip']:
             skip_indices.append(i)
         elif section['text_length'] < SMALL_SECTION_THRESHOLD:
             small_indices.append(i)
@@ -253,15 +374,6 @@ async def process_and_replace_sections_inline(html):
     MAX_BATCH_SIZE = 5  # Max sections per batch
     MAX_BATCH_CHARS = 10000  # Max combined chars per batch
 
-    # Add skip tasks
-    for idx in skip_indices:
-        section_map[len(process_tasks)] = [idx]
-        process_tasks.append({
-            'type': 'skip',
-            'section_indices': [idx],
-            'html': sections[idx]['html']
-        })
-
     # Batch small sections together (up to limits)
     current_batch = []
     current_batch_size = 0
@@ -348,119 +460,223 @@ async def process_and_replace_sections_inline(html):
         individual_count += 1
 
     # Debug: Show section size distribution
-    if os.environ.get('DEBUG_SECTIONS', 'false').lower() == 'true':
-        print("\n[DEBUG] Section size distribution:")
+    debug_sections = logger.isEnabledFor(logging.DEBUG)
+    if debug_sections:
+        logger.debug("Section size distribution:")
         for idx, section in enumerate(sections):
-            status = "SKIP" if should_skip_section(section['heading_text'], section['html']) else "PROCESS"
-            print(f"  Section {idx} ({section['type']}): {section['text_length']} chars, heading='{section['heading_text'][:30]}...', status={status}")
-        print()
+            status = "SKIP" if section['skip'] else "PROCESS"
+            logger.debug("  Section %d (%s): %d chars, heading='%.30s...', status=%s",
+                         idx, section['type'], section['text_length'], section['heading_text'], status)
+
+    logger.info("Total sections: %d, Skipped: %d, Batched: %d, Individual: %d, API calls: %d",
+                len(sections), skip_count, batch_count, individual_count, len(process_tasks))
+
+    return content_div, sections, process_tasks
 
-    print(f"[OPTIMIZED] Total sections: {len(sections)}, Skipped: {skip_count}, Batched: {batch_count}, Individual: {individual_count}, API calls: {len(process_tasks)}")
+
+def collect_rewrite_requests(content: bytes) -> list:
+    """
+    List the LLM requests a page would make, without calling the LLM.
+
+    Args:
+        content: The HTML page as bytes, after rewrite_urls
+
+    Returns:
+        List of (html_blob, num_sections) tuples, as passed to update_content
+    """
+    tree = parse_page(content)
+    _, _, process_tasks = plan_rewrite(tree)
+    return [(task['html'], task.get('num_sections', 1)) for task in process_tasks]
+
+
+async def rewrite_sections(tree):
+    """
+    Extract sections, process them in parallel with async LLM, and replace inline.
+    Uses optimized approach: extract, filter/batch, async parallel process, reconstruct.
+
+    Args:
+        tree: Parsed lxml document, modified in place
+
+    Returns:
+        True if every section was rewritten, False if any kept its original
+    """
+    content_div, sections, process_tasks = plan_rewrite(tree)
+    debug_sections = logger.isEnabledFor(logging.DEBUG)
 
     # ==================== PHASE 2: PROCESS TASKS IN PARALLEL ====================
-    async def process_task(task):
-        """Process a single task (skip, batch, or individual)"""
-        try:
-            if task['type'] == 'skip':
-                # Return original HTML
-                return {
-                    'success': True,
-                    'results': [task['html']],
-                    'section_indices': task['section_indices']
-                }
-            elif task['type'] == 'batch':
-                # Process batched sections
-                updated_html = await update_content(task['html'])
-                # Split back into individual sections
-                split_results = split_batch_result(updated_html, task['num_sections'])
-                if len(split_results) != task['num_sections']:
-                    # Split failed, return originals
-                    print(f"[WARN] Batch split failed, using originals")
-                    original_parts = task['html'].split('<!-- SECTION_BREAK_')
-                    results = [original_parts[0]]
-                    for part in original_parts[1:]:
-                        results.append(part.split('-->', 1)[1] if '-->' in part else part)
-                    return {
-                        'success': False,
-                        'results': results,
-                        'section_indices': task['section_indices']
-                    }
-                return {
-                    'success': True,
-                    'results': split_results,
-                    'section_indices': task['section_indices']
-                }
-            else:  # individual
-                # Process single section
-                updated_html = await update_content(task['html'])
+    # The semaphore is shared by every page on this event loop, so at most
+    # LLM_CONCURRENCY calls are in flight no matter how many pages are open.
+    llm_semaphore = get_llm_semaphore()
+    llm_calls = {'queued': 0, 'active': 0}
+
+    async def rewrite_with_limit(html_blob, num_sections=1):
+        """Call the LLM once a concurrency slot is free"""
+        llm_calls['queued'] += 1
+        async with llm_semaphore:
+            llm_calls['queued'] -= 1
+            llm_calls['active'] += 1
+            if debug_sections:
+                logger.debug("LLM calls active: %d, queued: %d", llm_calls['active'], llm_calls['queued'])
+            try:
+                return await update_content(html_blob, num_sections)
+            finally:
+                llm_calls['active'] -= 1
+
+    def build_task_result(task, updated_html):
+        """Map the LLM reply for a task (batch or individual) back to its sections"""
+        if updated_html is None:
+            # No reply for this task, keep the originals
+            return {
+                'success': False,
+                'results': [],
+                'section_indices': task['section_indices']
+            }
+        if task['type'] == 'batch':
+            # Split back into individual sections
+            split_results = parse_batch_result(updated_html, task['num_sections'])
+            if len(split_results) != task['num_sections']:
+                # Split failed, keep the originals
+                logger.warning("Batch split failed, using originals")
                 return {
-                    'success': True,
-                    'results': [updated_html],
+                    'success': False,
+                    'results': [],
                     'section_indices': task['section_indices']
                 }
-        except Exception as e:
-            print(f"[ERROR] Task processing failed: {e}")
-            # Return originals on error
             return {
-                'success': False,
-                'results': [sections[idx]['html'] for idx in task['section_indices']],
+                'success': True,
+                'results': split_results,
                 'section_indices': task['section_indices']
             }
+        return {
+            'success': True,
+            'results': [updated_html],
+            'section_indices': task['section_indices']
+        }
+
+    async def process_task(task):
+        """Process a single task (batch or individual)"""
+        try:
+            updated_html = await rewrite_with_limit(task['html'], task.get('num_sections', 1))
+            return build_task_result(task, updated_html)
+        except Exception as e:
+            logger.error("Task processing failed: %s", e)
+            # Keep the originals on error
+            return build_task_result(task, None)
+
+    def apply_task_result(task_result):
+        """Splice a task's rewritten sections into the tree, returning whether it succeeded"""
+        if not task_result['success']:
+            # The original elements are still in the tree, nothing to splice
+            return False
+        for i, section_idx in enumerate(task_result['section_indices']):
+            section = sections[section_idx]
+            updated_html = None
+            if i < len(task_result['results']):
+                updated_html = task_result['results'][i]
+            if updated_html is None:
+                updated_html = section['html']
+
+            splice_section(
+                content_div,
+                section['insert_after'],
+                section['elements_to_remove'],
+                updated_html
+            )
+        return True
 
-    # Process all tasks concurrently
+    # ============ PHASE 3: RECONSTRUCT HTML AS RESULTS ARRIVE ============
+    # Each section is spliced relative to its own heading anchor, so results
+    # can be applied in completion order while slower LLM calls are in flight.
     llm_start_time = time.perf_counter()
-    task_results = await asyncio.gather(*[process_task(task) for task in process_tasks])
+    complete = True
+    if LLM_BATCH_MODE and process_tasks:
+        # Offline mode: the whole page goes out as one Message Batch
+        try:
+            replies = await update_content_batch(
+                [task['html'] for task in process_tasks],
+                [task.get('num_sections', 1) for task in process_tasks]
+            )
+        except Exception as e:
+            logger.error("Message Batch failed: %s", e)
+            replies = [None] * len(process_tasks)
+        for task, updated_html in zip(process_tasks, replies):
+            complete &= apply_task_result(build_task_result(task, updated_html))
+    else:
+        for next_result in asyncio.as_completed([process_task(task) for task in process_tasks]):
+            complete &= apply_task_result(await next_result)
     llm_end_time = time.perf_counter()
-    print(f"Total LLM time: {(llm_end_time - llm_start_time):.2f}s")
+    logger.info("Total LLM time: %.2fs", llm_end_time - llm_start_time)
+    return complete
 
-    # Map results back to sections
-    section_results = [None] * len(sections)
-    for task_result in task_results:
-        for i, section_idx in enumerate(task_result['section_indices']):
-            if i < len(task_result['results']):
-                section_results[section_idx] = task_result['results'][i]
-            else:
-                section_results[section_idx] = sections[section_idx]['html']
 
-    # ==================== PHASE 3: RECONSTRUCT HTML ====================
-    for section, updated_html in zip(sections, section_results):
-        if updated_html is None:
-            updated_html = section['html']
+async def process_and_replace_sections_inline(html):
+    """
+    Rewrite the article sections of an HTML page.
+
+    Args:
+        html: Original HTML string
 
-        if section['type'] == 'intro':
-            new_intro = BeautifulSoup(updated_html, 'html.parser')
-            children_list = list(new_intro.children)
+    Returns:
+        Modified HTML string
+    """
+    tree = await asyncio.to_thread(lxml.html.document_fromstring, html)
+    await rewrite_sections(tree)
+    return await asyncio.to_thread(lxml.html.tostring, tree.getroottree(), encoding='unicode')
 
-            if children_list:
-                if section['insert_before']:
-                    section['insert_before'].insert_before(children_list[0])
-                else:
-                    content_div.insert(0, children_list[0])
 
-                insert_after = children_list[0]
-                for new_elem in children_list[1:]:
-                    insert_after.insert_after(new_elem)
-                    insert_after = new_elem
+async def process_article(content: bytes) -> tuple:
+    """
+    Rewrite the article sections of a UTF-8 encoded page.
 
-            for elem in section['elements_to_remove']:
-                if hasattr(elem, 'decompose'):
-                    elem.decompose()
-        else:  # section
-            new_content = BeautifulSoup(updated_html, 'html.parser')
+    Parsing and serializing are CPU-bound, so they run in a worker thread
+    (lxml releases the GIL) and leave the event loop free for LLM I/O.
 
-            insert_after = section['insert_after']
-            for new_elem in list(new_content.children):
-                insert_after.insert_after(new_elem)
-                insert_after = new_elem
+    Args:
+        content: The HTML page as bytes
 
-            for elem in section['elements_to_remove']:
-                if hasattr(elem, 'decompose'):
-                    elem.decompose()
+    Returns:
+        Tuple of (modified HTML page as bytes, whether every section was rewritten)
+    """
+    tree = await asyncio.to_thread(parse_page, content)
+    complete = await rewrite_sections(tree)
+    processed_html = await asyncio.to_thread(lxml.html.tostring, tree.getroottree(), encoding='utf-8')
+    return processed_html, complete
 
-    return str(soup)
 
+def get_processing_loop() -> asyncio.AbstractEventLoop:
+    """Get or start the long-lived event loop that runs page processing"""
+    global _processing_loop
+    with _processing_loop_lock:
+        if _processing_loop is None:
+            _processing_loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_processing_loop.run_forever,
+                name='html-processing-loop',
+                daemon=True
+            ).start()
+        return _processing_loop
 
-def process_html(content: bytes, content_type: Optional[str], path: str) -> bytes:
+
+def close_processing_loop():
+    """Close the shared LLM client and stop the long-lived event loop"""
+    global _processing_loop
+    with _processing_loop_lock:
+        loop, _processing_loop = _processing_loop, None
+    if loop is None:
+        return
+    asyncio.run_coroutine_threadsafe(llm.close_async_client(), loop).result(timeout=5)
+    loop.call_soon_threadsafe(loop.stop)
+
+
+atexit.register(close_processing_loop)
+
+
+def is_article_path(path: str) -> bool:
+    """Check whether a request path is an article, not a special page like Special:, File:, etc."""
+    return (path.startswith('/wiki/') or path.startswith('wiki/')) and ':' not in path
+
+
+async def process_html_async(content: bytes, content_type: Optional[str], path: str) -> bytes:
     """
     Main function to process HTML content through the rewriting pipeline.
 
@@ -474,19 +690,57 @@ def process_html(content: bytes, content_type: Optional[str], path: str) -> byte
     """
     process_html_start_time = time.perf_counter()
 
+    if not content_type or not content_type.startswith('text/html'):
+        return content
+
     content = rewrite_urls(content, content_type)
 
-    if not content_type or 'text/html' not in content_type:
+    if not is_article_path(path):
         return content
 
-    if not (path.startswith('/wiki/') or path.startswith('wiki/')) or ':' in path:  # Skip special pages like Special:, File:, etc.
-        return content
+    # Bytes in, bytes out: no str decode/encode round-trip around lxml
+    processed_html, _ = await process_article(content)
 
-    html_string = content.decode('utf-8')
-    processed_html = asyncio.run(process_and_replace_sections_inline(html_string))
+    process_html_end_time = time.perf_counter()
+    total_time = process_html_end_time - process_html_start_time
+    logger.info("Total time to process page: %.6f", total_time)
+
+    return processed_html
+
+
+def process_page(content: bytes, content_type: Optional[str], path: str) -> tuple:
+    """
+    Synchronous version of process_html_async for WSGI request handlers.
+
+    URL rewriting and the page checks run on the calling request thread. Only
+    the article rewrite is submitted to the long-lived event loop, so requests
+    don't pay for loop setup/teardown, the LLM client's connections stay
+    pooled, and the loop thread is left free for LLM I/O.
+
+    Returns:
+        Tuple of (processed HTML content as bytes, whether every section that
+        should have been rewritten was), so callers only cache complete pages
+    """
+    process_html_start_time = time.perf_counter()
+
+    if not content_type or not content_type.startswith('text/html'):
+        return content, True
+
+    content = rewrite_urls(content, content_type)
+
+    if not is_article_path(path):
+        return content, True
+
+    future = asyncio.run_coroutine_threadsafe(process_article(content), get_processing_loop())
+    processed_html, complete = future.result()
 
     process_html_end_time = time.perf_counter()
     total_time = process_html_end_time - process_html_start_time
-    print(f"Total time to process page: {total_time:.6f}")
+    logger.info("Total time to process page: %.6f", total_time)
+
+    return processed_html, complete
 
-    return processed_html.encode("utf-8")
+
+def process_html(content: bytes, content_type: Optional[str], path: str) -> bytes:
+    """Process a page with process_page, returning only the processed HTML"""
+    return process_page(content, content_type, path)[0]
@@ -4,14 +4,57 @@ LLM integration module for content rewriting using Claude
 """
 
 import os
+import asyncio
+import logging
+import weakref
 from typing import Optional
-from anthropic import AsyncAnthropic
+import httpx
+from anthropic import AsyncAnthropic, DefaultAsyncHttpxClient
+from src import response_cache
+
+logger = logging.getLogger(__name__)
 
 # Configuration
-ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY', '')
 CLAUDE_MODEL = "claude-haiku-4-5-20251001"
 MAX_MODEL_TOKENS = 64000
-USE_STREAMING = os.getenv('USE_STREAMING', 'false').lower() == 'true'
+# Floor for max_tokens: slang rewrites of short sections can come out several
+# times longer than the input, and a truncated reply breaks the section's HTML
+MIN_OUTPUT_TOKENS = 512
+# Extra output budget for batches: their sections come back as JSON strings,
+# and escaping every quote, backslash and newline in the HTML adds tokens
+BATCH_OUTPUT_OVERHEAD = 1.5
+# Greedy sampling: identical sections get identical rewrites, so cached
+# responses are exactly what Claude would have returned
+TEMPERATURE = 0
+# Bump whenever the prompts or sampling change so cached rewrites are invalidated
+PROMPT_VERSION = "2"
+# Seconds between status checks while a Message Batch is processing
+BATCH_POLL_INTERVAL = 30
+
+def configure():
+    """
+    Read the settings that come from the environment.
+
+    Runs at import; call it again after changing the environment (e.g. in
+    tests) instead of re-importing the module. Clients created afterwards
+    use the new values.
+    """
+    global ANTHROPIC_API_KEY, USE_STREAMING, LLM_KEEPALIVE_EXPIRY, LLM_MAX_RETRIES
+    ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY', '')
+    USE_STREAMING = os.getenv('USE_STREAMING', 'false').lower() == 'true'
+    # Seconds an idle connection to the API is kept open for reuse. httpx defaults
+    # to 5s, which drops the TLS connection between most page views.
+    LLM_KEEPALIVE_EXPIRY = float(os.getenv('LLM_KEEPALIVE_EXPIRY', '60'))
+    # Retries for rate limits (429), overload (529), and 5xx errors. The SDK backs
+    # off exponentially with jitter and honours retry-after, so bursts that
+    # overrun the rate limit are retried instead of dropping sections.
+    LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '5'))
+
+configure()
+
+# Rewrites currently in progress per event loop, keyed by make_cache_key, so
+# concurrent requests for identical content share one Claude call
+_in_flight = weakref.WeakKeyDictionary()
 
 # Singleton async client - reused across all requests
 _async_client = None
@@ -20,10 +63,29 @@ def get_async_client() -> AsyncAnthropic:
     """Get or create the singleton async Anthropic client"""
     global _async_client
     if _async_client is None:
-        _async_client = AsyncAnthropic(api_key=ANTHROPIC_API_KEY)
+        _async_client = AsyncAnthropic(
+            api_key=ANTHROPIC_API_KEY,
+            max_retries=LLM_MAX_RETRIES,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=1000,
+                    max_keepalive_connections=100,
+                    keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+                )
+            )
+        )
     return _async_client
 
-# System prompt with cache control for prompt caching
+async def close_async_client():
+    """Close the singleton client's connection pool, if one was created"""
+    global _async_client
+    if _async_client is not None:
+        client, _async_client = _async_client, None
+        await client.close()
+
+# System prompt with cache control for prompt caching.
+# The text must stay byte-identical across calls for the cached prefix to hit;
+# the 1h TTL keeps it warm between bursts of page views.
 SYSTEM_PROMPT = [
     {
         "type": "text",
@@ -59,47 +121,132 @@ You will be given a snippet of HTML wikipedia content and you should rewrite it
 You must preserve all the links and HTML elements of the content. Only the words should be changed.
 You must only reply with the updated HTML content and nothing else.
 </IMPORTANT>""",
-        "cache_control": {"type": "ephemeral"}
+        "cache_control": {"type": "ephemeral", "ttl": "1h"}
     }
 ]
 
-PROMPT_TEMPLATE = """Re-write this HTML content for Gen Z:
+# User prompts are a fixed header followed by the HTML, joined by plain
+# concatenation so the (large) HTML never goes through str.format
+PROMPT_PREFIX = """Re-write this HTML content for Gen Z:
+
+"""
+
+BATCH_PROMPT_PREFIX = """Re-write these {NUM_SECTIONS} HTML sections for Gen Z. The sections are separated by <!-- SECTION_BREAK_N --> comments.
+
+Reply with only a JSON array holding one object per section, in order, of the form {{"i": <section number starting at 0>, "html": "<rewritten section HTML>"}}. Do not include the SECTION_BREAK comments in the rewritten HTML.
 
-{HTML_CONTENT}"""
+"""
 
-def calculate_max_tokens(input_text: str) -> int:
+def calculate_max_tokens(input_text: str, num_sections: int = 1) -> int:
     """
     Calculate smart max_tokens based on input size.
-    Uses heuristic: ~4 chars per token, then add 50% buffer for rewriting.
+    Uses heuristic: ~4 chars per token, then add 50% buffer for rewriting,
+    and BATCH_OUTPUT_OVERHEAD more for batches answered as JSON.
     """
     estimated_input_tokens = len(input_text) // 4
     # Add 50% buffer for expansion during rewriting
-    estimated_output_tokens = min(int(estimated_input_tokens * 1.5), MAX_MODEL_TOKENS)
-    return estimated_output_tokens
+    estimated_output_tokens = estimated_input_tokens * 1.5
+    if num_sections > 1:
+        estimated_output_tokens *= BATCH_OUTPUT_OVERHEAD
+    estimated_output_tokens = min(int(estimated_output_tokens), MAX_MODEL_TOKENS)
+    return max(estimated_output_tokens, MIN_OUTPUT_TOKENS)
+
+def build_rewrite_prompt(html_content: str, num_sections: int = 1) -> str:
+    """Build the user prompt for a single section or a batch of sections"""
+    if num_sections > 1:
+        return BATCH_PROMPT_PREFIX.format(NUM_SECTIONS=num_sections) + html_content
+    return PROMPT_PREFIX + html_content
+
+def make_cache_key(html_content: str, num_sections: int = 1) -> str:
+    """Response cache key for a rewrite of html_content with the current prompts and model"""
+    return response_cache.make_key(PROMPT_VERSION, CLAUDE_MODEL, str(num_sections), html_content)
+
+def log_cache_usage(usage):
+    """Log how much of the prompt was served from the prompt cache"""
+    logger.debug(
+        "Prompt cache: read %s, written %s, uncached input %s tokens",
+        getattr(usage, 'cache_read_input_tokens', None),
+        getattr(usage, 'cache_creation_input_tokens', None),
+        usage.input_tokens
+    )
+
+def response_text(message) -> str:
+    """Text of a Claude reply, refusing replies that were cut off at max_tokens"""
+    if message.stop_reason == "max_tokens":
+        # A truncated section is broken HTML and a truncated batch is broken
+        # JSON; failing here keeps the originals and keeps it out of the cache
+        raise Exception("Rewrite truncated at max_tokens")
+    return message.content[0].text
+
+async def rewrite_content(html_content: str, num_sections: int = 1) -> str:
+    """
+    Rewrite HTML content, reusing a cached rewrite of identical content if the
+    response cache is enabled (see RESPONSE_CACHE_PATH). Concurrent calls with
+    identical content wait on the same rewrite instead of each calling Claude.
+
+    Args:
+        html_content: The HTML content to rewrite
+        num_sections: Number of SECTION_BREAK-separated sections in the content
 
-async def rewrite_content(html_content: str) -> str:
+    Returns:
+        Rewritten HTML content
+    """
+    cache_key = make_cache_key(html_content, num_sections)
+    in_flight = _in_flight.setdefault(asyncio.get_running_loop(), {})
+    task = in_flight.get(cache_key)
+    if task is None:
+        task = in_flight[cache_key] = asyncio.ensure_future(
+            cached_rewrite(cache_key, html_content, num_sections)
+        )
+        task.add_done_callback(lambda _: in_flight.pop(cache_key, None))
+    # Shielded so one cancelled caller doesn't fail the others sharing the task
+    return await asyncio.shield(task)
+
+async def cached_rewrite(cache_key: str, html_content: str, num_sections: int) -> str:
+    """Serve a rewrite from the response cache, generating and storing it on a miss"""
+    if not response_cache.is_enabled():
+        return await generate_rewrite(html_content, num_sections)
+
+    cached = await response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    result = await generate_rewrite(html_content, num_sections)
+    await store_rewrite(cache_key, result)
+    return result
+
+async def store_rewrite(cache_key: str, result: str):
+    """Cache a rewrite; a cache failure is logged rather than losing the paid-for result"""
+    try:
+        await response_cache.put(cache_key, result)
+    except Exception as e:
+        logger.warning("Failed to cache rewrite: %s", e)
+
+async def generate_rewrite(html_content: str, num_sections: int = 1) -> str:
     """
     Asynchronously rewrite HTML content using Claude with prompt caching.
     Supports both streaming and non-streaming modes via USE_STREAMING env var.
 
     Args:
         html_content: The HTML content to rewrite
+        num_sections: Number of SECTION_BREAK-separated sections in the content;
+            batches are answered as a JSON array (see BATCH_PROMPT_PREFIX)
 
     Returns:
         Rewritten HTML content
     """
-    rewrite_prompt = PROMPT_TEMPLATE.format(HTML_CONTENT=html_content)
+    rewrite_prompt = build_rewrite_prompt(html_content, num_sections)
     client = get_async_client()
 
-    max_tokens = calculate_max_tokens(html_content)
+    max_tokens = calculate_max_tokens(html_content, num_sections)
 
     if USE_STREAMING:
-        # Streaming mode - slower but provides real-time feedback
-        result_text = ""
+        # Streaming mode - opt-in only; nothing reads the text incrementally,
+        # so the SDK assembles the final message instead of a per-chunk loop
         async with client.messages.stream(
             model=CLAUDE_MODEL,
             max_tokens=max_tokens,
-            temperature=0.7,
+            temperature=TEMPERATURE,
             system=SYSTEM_PROMPT,
             messages=[
                 {
@@ -108,15 +255,15 @@ async def rewrite_content(html_content: str) -> str:
                 }
             ]
         ) as stream:
-            async for text in stream.text_stream:
-                result_text += text
-        return result_text
+            response = await stream.get_final_message()
+        log_cache_usage(response.usage)
+        return response_text(response)
     else:
         # Non-streaming mode - faster (10-15% improvement)
         response = await client.messages.create(
             model=CLAUDE_MODEL,
             max_tokens=max_tokens,
-            temperature=0.7,
+            temperature=TEMPERATURE,
             system=SYSTEM_PROMPT,
             messages=[
                 {
@@ -125,5 +272,70 @@ async def rewrite_content(html_content: str) -> str:
                 }
             ]
         )
+        log_cache_usage(response.usage)
         # Extract text from response
-        return response.content[0].text
+        return response_text(response)
+
+async def rewrite_content_batch(html_contents: list, num_sections: Optional[list] = None) -> list:
+    """
+    Rewrite many HTML blobs through the Message Batches API.
+
+    Batches are billed at half price but can take minutes to hours, so this is
+    meant for offline work like warming the response cache, not page requests.
+    Successful rewrites are stored in the response cache when it is enabled.
+
+    Args:
+        html_contents: The HTML contents to rewrite
+        num_sections: Number of sections in each content (defaults to 1 each)
+
+    Returns:
+        Rewritten HTML per input, in input order; None where a request failed
+    """
+    if num_sections is None:
+        num_sections = [1] * len(html_contents)
+    if not html_contents:
+        return []
+
+    client = get_async_client()
+    batch = await client.messages.batches.create(
+        requests=[
+            {
+                "custom_id": str(i),
+                "params": {
+                    "model": CLAUDE_MODEL,
+                    "max_tokens": calculate_max_tokens(html_content, sections),
+                    "temperature": TEMPERATURE,
+                    "system": SYSTEM_PROMPT,
+                    "messages": [
+                        {
+                            "role": "user",
+                            "content": build_rewrite_prompt(html_content, sections)
+                        }
+                    ]
+                }
+            }
+            for i, (html_content, sections) in enumerate(zip(html_contents, num_sections))
+        ]
+    )
+
+    while batch.processing_status != "ended":
+        await asyncio.sleep(BATCH_POLL_INTERVAL)
+        batch = await client.messages.batches.retrieve(batch.id)
+
+    # Results are streamed in arbitrary order; custom_id is the input index
+    results = [None] * len(html_contents)
+    async for entry in await client.messages.batches.results(batch.id):
+        if entry.result.type == "succeeded":
+            try:
+                results[int(entry.custom_id)] = response_text(entry.result.message)
+            except Exception as e:
+                logger.warning("Batch request %s failed: %s", entry.custom_id, e)
+        else:
+            logger.warning("Batch request %s did not succeed: %s", entry.custom_id, entry.result.type)
+
+    if response_cache.is_enabled():
+        for html_content, sections, result in zip(html_contents, num_sections, results):
+            if result is not None:
+                await store_rewrite(make_cache_key(html_content, sections), result)
+
+    return results
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+In-memory LRU cache of processed pages, revalidated against Wikipedia's ETag
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+# Configuration - caching is disabled unless a byte budget is set
+PAGE_CACHE_MAX_BYTES = int(os.getenv('PAGE_CACHE_MAX_BYTES', '0'))
+
+
+class CachedPage(NamedTuple):
+    """A processed page and the upstream validator it was built from"""
+    etag: str
+    content_type: str
+    content: bytes
+    headers: dict
+
+
+# Pages keyed by upstream URL, least recently used first
+_pages = OrderedDict()
+_size = 0
+_lock = threading.Lock()
+
+
+def is_enabled() -> bool:
+    """Check whether a cache budget has been configured"""
+    return PAGE_CACHE_MAX_BYTES > 0
+
+
+def get(url: str) -> Optional[CachedPage]:
+    """Return the cached page for url, or None, marking it recently used"""
+    with _lock:
+        page = _pages.get(url)
+        if page is not None:
+            _pages.move_to_end(url)
+        return page
+
+
+def put(url: str, page: CachedPage):
+    """Store page under url, evicting least recently used pages to stay in budget"""
+    global _size
+    if len(page.content) > PAGE_CACHE_MAX_BYTES:
+        return
+    with _lock:
+        old = _pages.pop(url, None)
+        if old is not None:
+            _size -= len(old.content)
+        _pages[url] = page
+        _size += len(page.content)
+        while _size > PAGE_CACHE_MAX_BYTES:
+            _, evicted = _pages.popitem(last=False)
+            _size -= len(evicted.content)
+
+
+def clear():
+    """Drop every cached page"""
+    global _size
+    with _lock:
+        _pages.clear()
+        _size = 0
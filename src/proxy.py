@@ -6,16 +6,78 @@ A simple HTTP proxy that forwards requests to Wikipedia and rewrites content.
 """
 
 import os
+import gzip
+import logging
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from flask import Flask, Response, request, redirect
 
-from src import html_processing
+from src import html_processing, page_cache
 
 app = Flask(__name__)
 
+logger = logging.getLogger(__name__)
+
 # Wikipedia base URL - use en.wikipedia.org directly
 WIKIPEDIA_BASE = "https://en.wikipedia.org"
 
+# Proxy path prefixes served by other hosts, with the upstream URL each maps to
+UPSTREAM_PREFIXES = (
+    ('wikimedia/', 'https://upload.wikimedia.org/'),
+)
+
+# Rewritten HTML at least this large is gzipped for clients that accept it
+COMPRESS_MIN_SIZE = 1024
+# Low gzip level: most of the size win for a fraction of the CPU of level 9
+GZIP_LEVEL = 4
+
+# Chunk size for streaming non-HTML resources to the client
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Encodings requests can decode for the HTML we rewrite. Wikipedia is only
+# offered the ones the client also accepts, because other resources are passed
+# through still encoded.
+UPSTREAM_ENCODINGS = ('gzip', 'deflate')
+
+# Sent upstream when the client has no User-Agent; Wikipedia blocks requests without one
+DEFAULT_USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                      '(KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36')
+
+# Headers copied from Wikipedia's response to ours
+FORWARD_HEADERS = (
+    'Cache-Control',
+    'ETag',
+    'Last-Modified',
+    'Content-Language',
+    'Vary'
+)
+
+CONTENT_SECURITY_POLICY = "upgrade-insecure-requests 'none'"
+
+# Shared session so connections to Wikipedia/Wikimedia are kept alive and
+# reused across requests instead of paying a TLS handshake every time
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=64,
+    max_retries=Retry(total=2, backoff_factor=0.2, allowed_methods=['GET'])
+))
+
+
+def html_response(content: bytes, status: int, content_type: str, headers: dict) -> Response:
+    """Build the response for processed HTML, gzipped if the client accepts it"""
+    # accept_encodings is the parsed header, so "gzip;q=0" counts as a refusal
+    compress = len(content) >= COMPRESS_MIN_SIZE and request.accept_encodings['gzip'] > 0
+    if compress:
+        content = gzip.compress(content, compresslevel=GZIP_LEVEL)
+    response = Response(content, status=status, content_type=content_type, headers=headers)
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    # The body depends on Accept-Encoding even if Wikipedia's Vary doesn't say so
+    response.vary.add('Accept-Encoding')
+    return response
+
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
@@ -24,9 +86,10 @@ def proxy(path):
     Proxy all requests to Wikipedia
     """
     # Special handling for Wikimedia resources
-    if path.startswith('wikimedia/'):
-        actual_path = path.replace('wikimedia/', '', 1)
-        target_url = f"https://upload.wikimedia.org/{actual_path}"
+    for prefix, upstream in UPSTREAM_PREFIXES:
+        if path.startswith(prefix):
+            target_url = upstream + path[len(prefix):]
+            break
     else:
         # For root path, redirect to Main Page
         if not path:
@@ -40,52 +103,92 @@ def proxy(path):
 
     try:
         # Get the User-Agent from the original request or use a default
-        # Wikipedia blocks requests without proper User-Agent
-        user_agent = request.headers.get('User-Agent',
-                                          'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36')
-
-        # Forward the request to Wikipedia
-        resp = requests.get(
+        user_agent = request.headers.get('User-Agent', DEFAULT_USER_AGENT)
+        upstream_headers = {
+            'User-Agent': user_agent,
+            'Accept-Encoding': ', '.join(
+                encoding for encoding in UPSTREAM_ENCODINGS if request.accept_encodings[encoding] > 0
+            ) or 'identity'
+        }
+
+        # A previously processed copy is only reused if Wikipedia confirms it is current
+        cached = page_cache.get(target_url) if page_cache.is_enabled() else None
+        if cached is not None:
+            upstream_headers['If-None-Match'] = cached.etag
+
+        # Forward the request to Wikipedia. The body is only read once we know
+        # whether it needs rewriting.
+        resp = SESSION.get(
             target_url,
-            headers={'User-Agent': user_agent},
-            allow_redirects=True
+            headers=upstream_headers,
+            allow_redirects=True,
+            stream=True
         )
 
         # Get the content type
-        content_type = resp.headers.get('content-type', '')
-
-        # Process HTML content (URL rewriting and LLM rewriting if enabled)
-        content = html_processing.process_html(resp.content, content_type, path)
-
-        # Create response
-        response = Response(
-            content,
-            status=resp.status_code,
-            content_type=content_type
-        )
+        # Passed through as-is; Response fills in its own default when it is missing
+        content_type = resp.headers.get('content-type')
+        is_html = content_type is not None and content_type.startswith('text/html')
 
         # Forward some headers from Wikipedia
-        forward_headers = [
-            'Cache-Control',
-            'ETag',
-            'Last-Modified',
-            'Content-Language',
-            'Vary'
-        ]
-
-        for header in forward_headers:
-            if header in resp.headers:
-                response.headers[header] = resp.headers[header]
+        forwarded = {
+            header: resp.headers[header]
+            for header in FORWARD_HEADERS
+            if header in resp.headers
+        }
+
+        if cached is not None and resp.status_code == 304:
+            # Unchanged upstream: serve the cached page without processing it again
+            resp.close()
+            response = html_response(cached.content, 200, cached.content_type,
+                                     {**cached.headers, **forwarded})
+        elif is_html:
+            # Process HTML content (URL rewriting and LLM rewriting if enabled)
+            content, complete = html_processing.process_page(resp.content, content_type, path)
+            etag = resp.headers.get('ETag')
+            # Pages with sections that fell back to the original aren't cached,
+            # or they would be served degraded until the article next changes
+            if page_cache.is_enabled() and resp.status_code == 200 and etag and complete:
+                page_cache.put(target_url, page_cache.CachedPage(etag, content_type, content, forwarded))
+            response = html_response(content, resp.status_code, content_type, forwarded)
+        else:
+            # Other resources are passed through chunk by chunk without buffering,
+            # left compressed so the client decompresses them instead of us
+            for header in ('Content-Encoding', 'Content-Length'):
+                if header in resp.headers:
+                    forwarded[header] = resp.headers[header]
+            response = Response(
+                resp.raw.stream(STREAM_CHUNK_SIZE, decode_content=False),
+                status=resp.status_code,
+                content_type=content_type,
+                headers=forwarded
+            )
+            response.vary.add('Accept-Encoding')
+            response.call_on_close(resp.close)
 
         # Add security headers
-        response.headers['Content-Security-Policy'] = "upgrade-insecure-requests 'none'"
+        response.headers['Content-Security-Policy'] = CONTENT_SECURITY_POLICY
 
         return response
 
     except requests.RequestException as e:
+        logger.warning("Error fetching %s: %s", target_url, e)
         return f"Error fetching from Wikipedia: {e}", 502
 
 
+def configure_logging():
+    """
+    Send the page, section and timing logs to stderr.
+
+    Called by the development server below and by gunicorn's post_worker_init
+    hook (config/gunicorn.conf.py). DEBUG_SECTIONS=true enables the
+    per-section debug logging.
+    """
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    if os.environ.get('DEBUG_SECTIONS', 'false').lower() == 'true':
+        html_processing.logger.setLevel(logging.DEBUG)
+
+
 @app.errorhandler(404)
 def not_found(e):
     """Handle 404 errors"""
@@ -94,7 +197,10 @@ def not_found(e):
 
 if __name__ == '__main__':
     port = 8000
+    configure_logging()
     print(f"Starting Wikipedia proxy server on http://localhost:{port}")
     print(f"Access Wikipedia through: http://localhost:{port}/")
     print(f"Example: http://localhost:{port}/wiki/Python_(programming_language)")
-    app.run(host='0.0.0.0', port=port, debug=False)
+    # Each request gets its own worker thread; LLM calls from all of them are
+    # multiplexed on html_processing's shared event loop.
+    app.run(host='0.0.0.0', port=port, debug=False, threaded=True)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+SQLite-backed cache of LLM rewrites, so identical sections are only paid for once
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from typing import Optional
+
+# Configuration - caching is disabled unless a database path is set
+RESPONSE_CACHE_PATH = os.getenv('RESPONSE_CACHE_PATH', '')
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', '86400'))
+
+# Seconds a write waits for another process (e.g. a second gunicorn worker)
+# to release the database before failing with "database is locked"
+BUSY_TIMEOUT = 30
+
+# Single connection shared by the worker threads, serialized by the lock
+_connection = None
+_lock = threading.Lock()
+
+
+def is_enabled() -> bool:
+    """Check whether a cache database has been configured"""
+    return bool(RESPONSE_CACHE_PATH)
+
+
+def make_key(*parts: str) -> str:
+    """Hash the parts that determine a rewrite into a fixed-size cache key"""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def get_connection() -> sqlite3.Connection:
+    """Get or open the singleton cache database connection (call with _lock held)"""
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(RESPONSE_CACHE_PATH, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        # WAL lets readers in other processes carry on while one of them writes
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+    return _connection
+
+
+def close():
+    """Close the cache database connection, if one was opened"""
+    global _connection
+    with _lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
+
+
+def get_sync(key: str) -> Optional[str]:
+    """Return the cached value for key, or None if it is missing or expired"""
+    with _lock:
+        row = get_connection().execute(
+            "SELECT value FROM responses WHERE key = ? AND expires_at > ?",
+            (key, time.time())
+        ).fetchone()
+    return row[0] if row else None
+
+
+def put_sync(key: str, value: str, ttl: Optional[int] = None):
+    """Store value under key for ttl seconds (RESPONSE_CACHE_TTL by default)"""
+    expires_at = time.time() + (RESPONSE_CACHE_TTL if ttl is None else ttl)
+    with _lock:
+        connection = get_connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, expires_at)
+        )
+        connection.commit()
+
+
+async def get(key: str) -> Optional[str]:
+    """Async lookup; the SQLite query runs in a worker thread"""
+    return await asyncio.to_thread(get_sync, key)
+
+
+async def put(key: str, value: str, ttl: Optional[int] = None):
+    """Async store; the SQLite write runs in a worker thread"""
+    await asyncio.to_thread(put_sync, key, value, ttl)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Warm the LLM response cache for a list of Wikipedia articles
+
+Every section request the proxy would make for the given articles is sent
+through the Message Batches API, and the rewrites are stored in the response
+cache, so later page views are served without waiting on Claude.
+
+Usage:
+    RESPONSE_CACHE_PATH=cache.sqlite3 python -m src.warm_cache Python_(programming_language) Flask
+"""
+
+import sys
+import asyncio
+import requests
+
+from src import html_processing, llm, response_cache
+from src.proxy import WIKIPEDIA_BASE
+
+USER_AGENT = 'Mozilla/5.0 (compatible; alternate-reality-cache-warmer)'
+
+
+def fetch_article(title: str) -> bytes:
+    """Fetch an article and apply the same URL rewriting as the proxy"""
+    resp = requests.get(f"{WIKIPEDIA_BASE}/wiki/{title}", headers={'User-Agent': USER_AGENT})
+    resp.raise_for_status()
+    content_type = resp.headers.get('content-type', '')
+    return html_processing.rewrite_urls(resp.content, content_type)
+
+
+def main(titles: list) -> int:
+    if not response_cache.is_enabled():
+        print("RESPONSE_CACHE_PATH must be set to warm the cache")
+        return 1
+
+    html_contents = []
+    num_sections = []
+    seen = set()
+    skipped = 0
+    for title in titles:
+        for html_blob, sections in html_processing.collect_rewrite_requests(fetch_article(title)):
+            cache_key = llm.make_cache_key(html_blob, sections)
+            # Don't pay again for rewrites that are already cached or already queued
+            if cache_key in seen or response_cache.get_sync(cache_key) is not None:
+                skipped += 1
+                continue
+            seen.add(cache_key)
+            html_contents.append(html_blob)
+            num_sections.append(sections)
+    print(f"Submitting {len(html_contents)} requests for {len(titles)} articles ({skipped} already cached)")
+
+    results = asyncio.run(llm.rewrite_content_batch(html_contents, num_sections))
+    print(f"Cached {sum(result is not None for result in results)} of {len(results)} rewrites")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -39,7 +39,7 @@ SAMPLE_HTML = """
 </html>
 """
 
-async def mock_update_content(html):
+async def mock_update_content(html, num_sections=1):
     """Mock async LLM function that adds a marker and simulates delay"""
     await asyncio.sleep(0.1)  # Simulate LLM API latency
     return html + "<!-- ASYNC PROCESSED -->"
@@ -89,7 +89,7 @@ async def test_async_error_handling():
 
     call_count = [0]
 
-    async def mock_update_with_error(html):
+    async def mock_update_with_error(html, num_sections=1):
         call_count[0] += 1
         # Fail on section 2 (call #2)
         if call_count[0] == 2:
@@ -66,9 +66,8 @@ SAMPLE_HTML = """
 </html>
 """
 
-async def mock_update_content(html):
+async def mock_update_content(html, num_sections=1):
     """Mock async LLM function"""
-    await asyncio.sleep(0.05)  # Simulate LLM latency
     return html + "<!-- PROCESSED -->"
 
 def test_should_skip_section():
@@ -76,17 +75,17 @@ def test_should_skip_section():
     print("Testing should_skip_section...")
 
     # Should skip - in skip list
-    assert should_skip_section('references', '<p>content</p>') == True
-    assert should_skip_section('see also', '<p>content</p>') == True
-    assert should_skip_section('external links', '<p>content</p>') == True
+    assert should_skip_section('references', len('content')) == True
+    assert should_skip_section('see also', len('content')) == True
+    assert should_skip_section('external links', len('content')) == True
 
     # Should skip - too small
-    assert should_skip_section('', '<p>x</p>') == True
-    assert should_skip_section('tiny', '<p>abc</p>') == True
+    assert should_skip_section('', len('x')) == True
+    assert should_skip_section('tiny', len('abc')) == True
 
     # Should not skip - need > 50 chars of text
-    assert should_skip_section('history', '<p>This is a normal section with enough content to process and it has more than fifty characters</p>') == False
-    assert should_skip_section('description', '<p>This is long enough content here with more than fifty characters of actual text content</p>') == False
+    assert should_skip_section('history', len('This is a normal section with enough content to process and it has more than fifty characters')) == False
+    assert should_skip_section('description', len('This is long enough content here with more than fifty characters of actual text content')) == False
 
     print("✓ should_skip_section works correctly")
     return True
@@ -165,9 +164,8 @@ async def test_batch_processing():
 
     call_count = [0]
 
-    async def counting_mock(html):
+    async def counting_mock(html, num_sections=1):
         call_count[0] += 1
-        await asyncio.sleep(0.01)
         return html + "<!-- PROCESSED -->"
 
     with patch('src.html_processing.update_content', side_effect=counting_mock):
@@ -210,9 +208,8 @@ async def test_skip_sections():
 
     call_count = [0]
 
-    async def counting_mock(html):
+    async def counting_mock(html, num_sections=1):
         call_count[0] += 1
-        await asyncio.sleep(0.01)
         return html + "<!-- PROCESSED -->"
 
     with patch('src.html_processing.update_content', side_effect=counting_mock):
@@ -231,17 +228,59 @@ async def test_skip_sections():
         return True
 
 def test_temperature_lowered():
-    """Test that temperature was lowered to 0.7"""
+    """Test that rewrites use deterministic temperature 0"""
     print("\nTesting temperature setting...")
 
     from src import llm
     import inspect
 
-    # Check the source code of rewrite_content for temperature
-    source = inspect.getsource(llm.rewrite_content)
-    assert "temperature=0.7" in source, "Temperature should be 0.7"
+    # Check the source code of the Claude call for temperature
+    source = inspect.getsource(llm.generate_rewrite)
+    assert "temperature=TEMPERATURE" in source, "Claude call should use TEMPERATURE"
+    assert llm.TEMPERATURE == 0, "Temperature should be 0"
 
-    print("✓ Temperature set to 0.7")
+    print("✓ Temperature set to 0")
+    return True
+
+async def test_batch_mode():
+    """Test that LLM_BATCH_MODE sends a whole page as one Message Batch"""
+    print("\nTesting Message Batch mode...")
+
+    from types import SimpleNamespace
+    from unittest.mock import MagicMock
+    from src import llm
+
+    created = []
+
+    async def create_batch(requests):
+        created.append(requests)
+        return SimpleNamespace(id="batch_1", processing_status="ended")
+
+    async def batch_results(batch_id):
+        async def entries():
+            for request in created[0]:
+                text = request["params"]["messages"][0]["content"].split("\n\n", 1)[1]
+                message = SimpleNamespace(content=[SimpleNamespace(text=text + "<!-- BATCHED -->")],
+                                          stop_reason="end_turn")
+                yield SimpleNamespace(custom_id=request["custom_id"],
+                                      result=SimpleNamespace(type="succeeded", message=message))
+        return entries()
+
+    mock_client = MagicMock()
+    mock_client.messages.batches.create = create_batch
+    mock_client.messages.batches.results = batch_results
+
+    interactive = AsyncMock()
+    with patch('src.html_processing.LLM_BATCH_MODE', True), \
+            patch('src.html_processing.update_content', interactive), \
+            patch.object(llm, 'get_async_client', return_value=mock_client):
+        result = await process_and_replace_sections_inline(SAMPLE_HTML)
+
+    assert len(created) == 1, f"Expected one batch, got {len(created)}"
+    assert not interactive.called, "Batch mode should not make interactive calls"
+    assert "<!-- BATCHED -->" in result
+
+    print(f"✓ Page sent as one batch of {len(created[0])} requests")
     return True
 
 async def main():
@@ -259,6 +298,7 @@ async def main():
         await test_optimized_processing()
         await test_batch_processing()
         await test_skip_sections()
+        await test_batch_mode()
 
         print("\n" + "=" * 60)
         print("All optimization tests passed! ✓")
@@ -267,7 +307,8 @@ async def main():
         print("  ✓ Section filtering (skip non-content)")
         print("  ✓ Small section batching")
         print("  ✓ Tiny section skipping")
-        print("  ✓ Temperature lowered to 0.7")
+        print("  ✓ Temperature lowered to 0")
+        print("  ✓ Message Batch mode")
         print("\nExpected results:")
         print("  - 30-50% fewer API calls")
         print("  - ~3-5x speedup overall")
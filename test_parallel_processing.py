@@ -3,8 +3,8 @@
 Simple test to verify parallel processing works correctly
 """
 
-import os
 import time
+import asyncio
 from src.html_processing import process_and_replace_sections_inline
 from unittest.mock import patch
 
@@ -14,35 +14,40 @@ SAMPLE_HTML = """
 <body>
 <div id="mw-content-text">
     <div class="mw-parser-output">
-        <p>This is the introduction paragraph.</p>
+        <p>This is the introduction paragraph, long enough to be rewritten.</p>
         <p>Another intro paragraph.</p>
 
         <div class="mw-heading mw-heading2">
             <h2>Section 1</h2>
         </div>
-        <p>Content for section 1.</p>
+        <p>Content for section 1, long enough to be sent to the model.</p>
         <p>More content for section 1.</p>
 
         <div class="mw-heading mw-heading2">
             <h2>Section 2</h2>
         </div>
-        <p>Content for section 2.</p>
+        <p>Content for section 2, long enough to be sent to the model.</p>
 
         <div class="mw-heading mw-heading2">
             <h2>Section 3</h2>
         </div>
-        <p>Content for section 3.</p>
+        <p>Content for section 3, long enough to be sent to the model.</p>
     </div>
 </div>
 </body>
 </html>
 """
 
-def mock_update_content(html):
+async def mock_update_content(html, num_sections=1):
     """Mock LLM function that adds a marker and simulates delay"""
-    time.sleep(0.1)  # Simulate LLM API latency
+    await asyncio.sleep(0.1)  # Simulate LLM API latency
     return html + "<!-- PROCESSED -->"
 
+def process_individually(html):
+    """Run the pipeline with every section sent as its own LLM call (no batching)"""
+    with patch('src.html_processing.SMALL_SECTION_THRESHOLD', 0):
+        return asyncio.run(process_and_replace_sections_inline(html))
+
 def test_parallel_processing():
     """Test that parallel processing works and maintains order"""
     print("Testing parallel processing...")
@@ -50,7 +55,7 @@ def test_parallel_processing():
     # Mock the update_content function
     with patch('src.html_processing.update_content', side_effect=mock_update_content):
         start_time = time.time()
-        result = process_and_replace_sections_inline(SAMPLE_HTML)
+        result = process_individually(SAMPLE_HTML)
         end_time = time.time()
 
         elapsed = end_time - start_time
@@ -89,7 +94,7 @@ def test_error_handling():
 
     call_count = [0]
 
-    def mock_update_with_error(html):
+    async def mock_update_with_error(html, num_sections=1):
         call_count[0] += 1
         # Fail on section 2 (call #2)
         if call_count[0] == 2:
@@ -97,7 +102,7 @@ def test_error_handling():
         return html + "<!-- PROCESSED -->"
 
     with patch('src.html_processing.update_content', side_effect=mock_update_with_error):
-        result = process_and_replace_sections_inline(SAMPLE_HTML)
+        result = process_individually(SAMPLE_HTML)
 
         # Should have 3 processed sections (1 failed with graceful degradation)
         processed_count = result.count("<!-- PROCESSED -->")
@@ -113,19 +118,28 @@ def test_error_handling():
         print("✓ Error handling works correctly")
         return True
 
-def test_thread_pool_configuration():
-    """Test that LLM_WORKERS env var is respected"""
-    print("\nTesting thread pool configuration...")
+def test_concurrency_limit():
+    """Test that LLM_CONCURRENCY bounds the number of in-flight LLM calls"""
+    print("\nTesting concurrency limit...")
+
+    for limit in [1, 2, 8]:
+        in_flight = [0]
+        peak = [0]
+
+        async def mock_update_tracking(html, num_sections=1):
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+            await asyncio.sleep(0.02)
+            in_flight[0] -= 1
+            return html + "<!-- PROCESSED -->"
 
-    # Test with different worker counts
-    for workers in [1, 5, 10]:
-        os.environ['LLM_WORKERS'] = str(workers)
+        with patch('src.html_processing.LLM_CONCURRENCY', limit), \
+                patch('src.html_processing.update_content', side_effect=mock_update_tracking):
+            result = process_individually(SAMPLE_HTML)
 
-        with patch('src.html_processing.update_content', side_effect=mock_update_content):
-            result = process_and_replace_sections_inline(SAMPLE_HTML)
-            processed_count = result.count("<!-- PROCESSED -->")
-            assert processed_count == 4
-            print(f"✓ Works with LLM_WORKERS={workers}")
+        assert result.count("<!-- PROCESSED -->") == 4
+        assert peak[0] == min(limit, 4), f"Expected {min(limit, 4)} calls in flight, got {peak[0]}"
+        print(f"✓ Works with LLM_CONCURRENCY={limit} (peak in flight: {peak[0]})")
 
     return True
 
@@ -137,7 +151,7 @@ if __name__ == '__main__':
     try:
         test_parallel_processing()
         test_error_handling()
-        test_thread_pool_configuration()
+        test_concurrency_limit()
 
         print("\n" + "=" * 60)
         print("All tests passed! ✓")
@@ -0,0 +1,29 @@
+"""
+Shared fixtures for the test suite
+"""
+
+import pytest
+from src import response_cache
+
+
+@pytest.fixture(scope='session')
+def llm_module():
+    """src.llm, imported once for the whole session"""
+    import src.llm
+    return src.llm
+
+
+@pytest.fixture(autouse=True)
+def restore_llm_config(llm_module):
+    """Re-read the real environment after each test so patched settings don't leak"""
+    yield
+    llm_module.configure()
+
+
+@pytest.fixture
+def cache_path(tmp_path, monkeypatch):
+    """Point the response cache at a fresh database file"""
+    path = str(tmp_path / 'responses.sqlite3')
+    monkeypatch.setattr(response_cache, 'RESPONSE_CACHE_PATH', path)
+    yield path
+    response_cache.close()
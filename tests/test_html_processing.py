@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the section rewriting pipeline in html_processing
+"""
+
+import asyncio
+import pytest
+from unittest.mock import patch
+from src import html_processing
+
+ARTICLE_HTML = '''<!DOCTYPE html>
+<html>
+<head><title>Test - Wikipedia</title></head>
+<body>
+<div id="mw-content-text">
+    <div class="mw-content-ltr mw-parser-output">
+        <p>This is the introduction with more than enough text to be rewritten by the model.</p>
+
+        <div class="mw-heading mw-heading2">
+            <h2>History</h2>
+        </div>
+        <p>History content that is long enough to be sent to the language model for rewriting.</p>
+
+        <div class="mw-heading mw-heading2">
+            <h2>References</h2>
+        </div>
+        <p>Reference content that should never be sent to the model at all.</p>
+    </div>
+</div>
+<a href="https://en.wikipedia.org/wiki/Other">Other</a>
+</body>
+</html>
+'''
+
+
+async def mock_update_content(html, num_sections=1):
+    """Mock LLM that marks rewritten words in upper case"""
+    return html.replace('content', 'CONTENT').replace('introduction', 'INTRODUCTION')
+
+
+class TestProcessHTML:
+    """Test the full process_html pipeline with a mocked LLM"""
+
+    @patch('src.html_processing.update_content', side_effect=mock_update_content)
+    def test_process_html_rewrites_sections(self, mock_update):
+        """Test that article sections are rewritten and returned as UTF-8 bytes"""
+        result = html_processing.process_html(
+            ARTICLE_HTML.encode('utf-8'), 'text/html; charset=utf-8', 'wiki/Test'
+        )
+
+        assert isinstance(result, bytes)
+        result_str = result.decode('utf-8')
+        assert 'INTRODUCTION' in result_str
+        assert 'History CONTENT' in result_str
+        # Skipped sections are left untouched
+        assert 'Reference content' in result_str
+        # Headings and surrounding page are preserved
+        assert '<h2>History</h2>' in result_str
+        assert '<title>Test - Wikipedia</title>' in result_str
+        assert 'http://localhost:8000/wiki/Other' in result_str
+
+    @patch('src.html_processing.update_content', side_effect=mock_update_content)
+    def test_process_html_skips_special_pages(self, mock_update):
+        """Test that special pages only get URL rewriting"""
+        result = html_processing.process_html(
+            ARTICLE_HTML.encode('utf-8'), 'text/html', 'wiki/Special:Search'
+        )
+
+        assert b'introduction' in result
+        mock_update.assert_not_called()
+
+    @patch('src.html_processing.get_processing_loop')
+    def test_non_articles_stay_on_request_thread(self, mock_loop):
+        """Test that URL rewriting of non-article pages never goes through the event loop"""
+        result = html_processing.process_html(
+            ARTICLE_HTML.encode('utf-8'), 'text/html', 'w/index.php'
+        )
+
+        assert b'http://localhost:8000/wiki/Other' in result
+        mock_loop.assert_not_called()
+
+    @patch('src.html_processing.update_content', side_effect=mock_update_content)
+    def test_process_html_async_matches_sync(self, mock_update):
+        """Test that the async entry point and the sync shim agree"""
+        content = ARTICLE_HTML.encode('utf-8')
+        sync_result = html_processing.process_html(content, 'text/html', 'wiki/Test')
+        async_result = asyncio.run(html_processing.process_html_async(content, 'text/html', 'wiki/Test'))
+
+        assert sync_result == async_result
+
+    def test_processing_loop_is_reused(self):
+        """Test that every request runs on the same long-lived event loop"""
+        loop = html_processing.get_processing_loop()
+
+        assert loop.is_running()
+        assert html_processing.get_processing_loop() is loop
+
+    def test_parsers_are_per_thread(self):
+        """Test that threads parsing pages concurrently never share an lxml parser"""
+        other = asyncio.run(asyncio.to_thread(html_processing.get_html_parser))
+
+        assert html_processing.get_html_parser() is html_processing.get_html_parser()
+        assert html_processing.get_html_parser() is not other
+
+
+class TestSectionRewriting:
+    """Test section extraction and reconstruction"""
+
+    @patch('src.html_processing.update_content', side_effect=mock_update_content)
+    def test_sections_keep_document_order(self, mock_update):
+        """Test that rewritten sections are spliced back under their headings"""
+        result = asyncio.run(html_processing.process_and_replace_sections_inline(ARTICLE_HTML))
+
+        intro_pos = result.index('INTRODUCTION')
+        history_pos = result.index('<h2>History</h2>')
+        history_content_pos = result.index('History CONTENT')
+        references_pos = result.index('<h2>References</h2>')
+        assert intro_pos < history_pos < history_content_pos < references_pos
+
+    @patch('src.html_processing.update_content', side_effect=mock_update_content)
+    def test_skipped_sections_are_not_sent(self, mock_update):
+        """Test that skipped sections never reach the LLM and stay in place"""
+        result = asyncio.run(html_processing.process_and_replace_sections_inline(ARTICLE_HTML))
+
+        for call in mock_update.call_args_list:
+            assert 'Reference content' not in call.args[0]
+        assert 'Reference content that should never be sent' in result
+
+    def test_failed_rewrite_is_logged_and_kept(self, caplog):
+        """Test that a failed LLM call leaves the original section and logs the error"""
+        async def failing_update(html, num_sections=1):
+            raise RuntimeError("API error")
+
+        with patch('src.html_processing.update_content', side_effect=failing_update):
+            result = asyncio.run(html_processing.process_and_replace_sections_inline(ARTICLE_HTML))
+
+        assert 'History content that is long enough' in result
+        assert 'Task processing failed: API error' in caplog.text
+
+    def test_process_page_reports_whether_every_section_was_rewritten(self):
+        """Test that process_page flags pages where a section kept its original"""
+        async def failing_update(html, num_sections=1):
+            raise RuntimeError("API error")
+
+        content = ARTICLE_HTML.encode('utf-8')
+        with patch('src.html_processing.update_content', side_effect=mock_update_content):
+            _, complete = html_processing.process_page(content, 'text/html', 'wiki/Test')
+        assert complete
+
+        with patch('src.html_processing.update_content', side_effect=failing_update):
+            _, complete = html_processing.process_page(content, 'text/html', 'wiki/Test')
+        assert not complete
+
+    def test_collect_rewrite_requests(self):
+        """Test that the planned LLM requests cover only non-skipped sections"""
+        requests = html_processing.collect_rewrite_requests(ARTICLE_HTML.encode('utf-8'))
+
+        assert len(requests) == 1
+        html_blob, num_sections = requests[0]
+        assert num_sections == 2
+        assert 'introduction' in html_blob and 'History content' in html_blob
+        assert 'Reference content' not in html_blob
+
+    def test_missing_content_div_raises(self):
+        """Test that pages without article content are rejected"""
+        with pytest.raises(Exception, match="mw-content-text"):
+            asyncio.run(html_processing.process_and_replace_sections_inline(
+                '<html><body><p>No article</p></body></html>'
+            ))
+
+
+class TestConcurrencyLimit:
+    """Test the LLM concurrency limit shared across pages"""
+
+    @patch('src.html_processing.SMALL_SECTION_THRESHOLD', 0)
+    @patch('src.html_processing.LLM_CONCURRENCY', 1)
+    def test_limit_is_shared_by_concurrent_pages(self):
+        """Test that pages processed on the same loop share one limit"""
+        in_flight = []
+        peak = []
+
+        async def mock_update_tracking(html, num_sections=1):
+            in_flight.append(html)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.remove(html)
+            return html
+
+        async def process_two_pages():
+            await asyncio.gather(
+                html_processing.process_and_replace_sections_inline(ARTICLE_HTML),
+                html_processing.process_and_replace_sections_inline(ARTICLE_HTML)
+            )
+
+        with patch('src.html_processing.update_content', side_effect=mock_update_tracking):
+            asyncio.run(process_two_pages())
+
+        assert len(peak) == 4
+        assert max(peak) == 1
+
+
+class TestBatchResults:
+    """Test parsing of batched LLM responses"""
+
+    def test_parse_json_envelope(self):
+        """Test that JSON batch replies are mapped back by index"""
+        reply = '[{"i": 1, "html": "<p>Second</p>"}, {"i": 0, "html": "<p>First</p>"}]'
+        assert html_processing.parse_batch_result(reply, 2) == ['<p>First</p>', '<p>Second</p>']
+
+    def test_parse_json_envelope_in_code_fence(self):
+        """Test that a JSON array wrapped in extra text is still found"""
+        reply = '```json\n[{"i": 0, "html": "<p>Only</p>"}]\n```'
+        assert html_processing.parse_batch_result(reply, 1) == ['<p>Only</p>']
+
+    def test_parse_falls_back_to_markers(self):
+        """Test that non-JSON replies are split on SECTION_BREAK markers"""
+        reply = '<p>A [1]</p><!-- SECTION_BREAK_0 --><p>B</p>'
+        assert html_processing.parse_batch_result(reply, 2) == ['<p>A [1]</p>', '<p>B</p>']
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -3,16 +3,19 @@
 Unit tests for the Wikipedia proxy server
 """
 
+import gzip
 import pytest
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import Mock, patch
 import requests
-from src.proxy import app
+import logging
+from src import html_processing, page_cache
+from src.proxy import app, SESSION, configure_logging
 from src.html_processing import rewrite_urls
 
 
-@pytest.fixture
+@pytest.fixture(scope='module')
 def client():
-    """Create a test client for the Flask app"""
+    """Create a test client for the Flask app, shared by the tests in this module"""
     app.config['TESTING'] = True
     with app.test_client() as client:
         yield client
@@ -57,12 +60,37 @@ class TestURLRewriting:
         assert 'https://upload.wikimedia.org' not in result_str
         assert 'http://localhost:8000/wikimedia' in result_str
 
+    def test_rewrite_mixed_urls(self):
+        """Test that each URL kind gets its own replacement in a single document"""
+        html_input = (
+            '<a href="https://en.wikipedia.org/wiki/A">A</a>'
+            '<img src="https://upload.wikimedia.org/b.png">'
+            '<link href="//en.wikipedia.org/c.css">'
+        )
+        result = rewrite_urls(html_input.encode('utf-8'), 'text/html').decode('utf-8')
+
+        assert result == (
+            '<a href="http://localhost:8000/wiki/A">A</a>'
+            '<img src="http://localhost:8000/wikimedia/b.png">'
+            '<link href="//localhost:8000/c.css">'
+        )
+
     def test_no_rewrite_non_html(self):
         """Test that non-HTML content is not rewritten"""
         json_input = b'{"url": "https://wikipedia.org/test"}'
         result = rewrite_urls(json_input, 'application/json')
         assert result == json_input
 
+    def test_no_rewrite_without_wiki_urls(self):
+        """Test that HTML without any Wikipedia URL is returned as-is"""
+        html_input = b'<a href="https://example.org/">Example</a>'
+        assert rewrite_urls(html_input, 'text/html') is html_input
+
+    def test_no_rewrite_with_only_relative_wiki_links(self):
+        """Test that relative /wiki/ links alone don't trigger the URL regex"""
+        html_input = b'<a href="/wiki/Python">Python</a>'
+        assert rewrite_urls(html_input, 'text/html') is html_input
+
     def test_rewrite_with_invalid_encoding(self):
         """Test that rewriting handles encoding errors gracefully"""
         invalid_bytes = b'\x80\x81\x82'
@@ -80,7 +108,7 @@ class TestProxyRoutes:
         assert response.status_code == 302
         assert '/wiki/Main_Page' in response.location
 
-    @patch('src.proxy.requests.get')
+    @patch.object(SESSION, 'get')
     def test_proxy_wiki_page(self, mock_get, client):
         """Test proxying a Wikipedia page"""
         # Mock Wikipedia response
@@ -98,7 +126,7 @@ class TestProxyRoutes:
         call_args = mock_get.call_args[0][0]
         assert 'wikipedia.org/wiki/Test_Page' in call_args
 
-    @patch('src.proxy.requests.get')
+    @patch.object(SESSION, 'get')
     def test_proxy_with_query_parameters(self, mock_get, client):
         """Test that query parameters are forwarded"""
         mock_response = Mock()
@@ -114,12 +142,12 @@ class TestProxyRoutes:
         assert 'search=Python' in call_args
         assert 'title=Special:Search' in call_args
 
-    @patch('src.proxy.requests.get')
+    @patch.object(SESSION, 'get')
     def test_proxy_wikimedia_resources(self, mock_get, client):
         """Test proxying Wikimedia resources"""
         mock_response = Mock()
         mock_response.status_code = 200
-        mock_response.content = b'IMAGE_DATA'
+        mock_response.raw.stream.return_value = iter([b'IMAGE_DATA'])
         mock_response.headers = {'content-type': 'image/jpeg'}
         mock_get.return_value = mock_response
 
@@ -130,33 +158,75 @@ class TestProxyRoutes:
         call_args = mock_get.call_args[0][0]
         assert 'upload.wikimedia.org/wikipedia/commons/test.jpg' in call_args
 
-    @patch('src.proxy.requests.get')
+    @patch.object(SESSION, 'get')
+    def test_non_html_is_streamed(self, mock_get, client):
+        """Test that non-HTML resources are streamed in chunks and the upstream response is closed"""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.raw.stream.return_value = iter([b'PART1', b'PART2'])
+        mock_response.headers = {'content-type': 'image/png'}
+        mock_get.return_value = mock_response
+
+        response = client.get('/wikimedia/wikipedia/commons/test.png')
+
+        assert response.data == b'PART1PART2'
+        assert mock_get.call_args[1]['stream'] is True
+        response.close()
+        mock_response.close.assert_called_once()
+
+    @patch.object(SESSION, 'get')
+    def test_non_html_is_passed_through_compressed(self, mock_get, client):
+        """Test that compressed resources are forwarded without being decoded"""
+        body = gzip.compress(b'body { color: red; }')
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.raw.stream.return_value = iter([body])
+        mock_response.headers = {
+            'content-type': 'text/css',
+            'Content-Encoding': 'gzip',
+            'Content-Length': str(len(body))
+        }
+        mock_get.return_value = mock_response
+
+        response = client.get('/w/load.php', headers={'Accept-Encoding': 'gzip, br'})
+
+        assert mock_get.call_args[1]['headers']['Accept-Encoding'] == 'gzip'
+        assert mock_response.raw.stream.call_args[1]['decode_content'] is False
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert response.headers['Content-Length'] == str(len(body))
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert response.data == body
+
+    @patch.object(SESSION, 'get')
+    def test_identity_requested_for_clients_without_compression(self, mock_get, client):
+        """Test that Wikipedia is not offered encodings the client can't decode"""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.raw.stream.return_value = iter([b'IMAGE_DATA'])
+        mock_response.headers = {'content-type': 'image/png'}
+        mock_get.return_value = mock_response
+
+        client.get('/wikimedia/wikipedia/commons/test.png')
+
+        assert mock_get.call_args[1]['headers']['Accept-Encoding'] == 'identity'
+
+        client.get('/wikimedia/wikipedia/commons/test.png',
+                   headers={'Accept-Encoding': 'gzip;q=0, deflate'})
+
+        assert mock_get.call_args[1]['headers']['Accept-Encoding'] == 'deflate'
+
+    @patch.object(SESSION, 'get')
     def test_proxy_forwards_headers(self, mock_get, client):
         """Test that appropriate headers are forwarded when present"""
-        # Use MagicMock with proper dict-like behavior
         mock_response = Mock()
         mock_response.status_code = 200
         mock_response.content = b'Content'
-
-        # Create a mock headers object that behaves like a dict
-        mock_headers = MagicMock()
-        mock_headers.__getitem__.side_effect = lambda k: {
+        mock_response.headers = requests.structures.CaseInsensitiveDict({
             'content-type': 'text/html',
             'Cache-Control': 'max-age=3600',
             'ETag': '"abc123"',
             'Last-Modified': 'Wed, 21 Oct 2025 07:28:00 GMT'
-        }.get(k)
-        mock_headers.__contains__.side_effect = lambda k: k in [
-            'content-type', 'Cache-Control', 'ETag', 'Last-Modified'
-        ]
-        mock_headers.get.side_effect = lambda k, d=None: {
-            'content-type': 'text/html',
-            'Cache-Control': 'max-age=3600',
-            'ETag': '"abc123"',
-            'Last-Modified': 'Wed, 21 Oct 2025 07:28:00 GMT'
-        }.get(k, d)
-
-        mock_response.headers = mock_headers
+        })
         mock_get.return_value = mock_response
 
         response = client.get('/wiki/Test')
@@ -168,7 +238,7 @@ class TestProxyRoutes:
         # Check CSP header is always set
         assert 'Content-Security-Policy' in response.headers
 
-    @patch('src.proxy.requests.get')
+    @patch.object(SESSION, 'get')
     def test_user_agent_forwarding(self, mock_get, client):
         """Test that user agent is properly set"""
         mock_response = Mock()
@@ -192,16 +262,18 @@ class TestProxyRoutes:
 class TestErrorHandling:
     """Test error handling"""
 
-    @patch('src.proxy.requests.get')
-    def test_handle_request_exception(self, mock_get, client):
+    @patch.object(SESSION, 'get')
+    def test_handle_request_exception(self, mock_get, client, caplog):
         """Test handling of request exceptions"""
         mock_get.side_effect = requests.RequestException("Connection failed")
 
-        response = client.get('/wiki/Test_Page')
+        with caplog.at_level('WARNING', logger='src.proxy'):
+            response = client.get('/wiki/Test_Page')
 
         assert response.status_code == 502
         assert b'Error fetching from' in response.data
         assert b'Connection failed' in response.data
+        assert 'Connection failed' in caplog.text
 
     def test_404_error_handler(self, client):
         """Test the custom 404 error handler"""
@@ -215,7 +287,7 @@ class TestErrorHandling:
             assert "Page not found" in result[0]
             assert result[1] == 404
 
-    @patch('src.proxy.requests.get')
+    @patch.object(SESSION, 'get')
     def test_handle_wikipedia_404(self, mock_get, client):
         """Test handling of Wikipedia 404 responses"""
         mock_response = Mock()
@@ -228,7 +300,7 @@ class TestErrorHandling:
 
         assert response.status_code == 404
 
-    @patch('src.proxy.requests.get')
+    @patch.object(SESSION, 'get')
     def test_non_existent_path_returns_wikipedia_404(self, mock_get, client):
         """Test that non-existent paths get Wikipedia's 404 page"""
         # Mock Wikipedia's 404 response
@@ -248,12 +320,12 @@ class TestErrorHandling:
 class TestContentTypes:
     """Test handling of different content types"""
 
-    @patch('src.proxy.requests.get')
+    @patch.object(SESSION, 'get')
     def test_handle_json_content(self, mock_get, client):
         """Test handling JSON API responses"""
         mock_response = Mock()
         mock_response.status_code = 200
-        mock_response.content = b'{"key": "value"}'
+        mock_response.raw.stream.return_value = iter([b'{"key": "value"}'])
         mock_response.headers = {'content-type': 'application/json'}
         mock_get.return_value = mock_response
 
@@ -263,12 +335,12 @@ class TestContentTypes:
         assert response.content_type == 'application/json'
         assert response.data == b'{"key": "value"}'
 
-    @patch('src.proxy.requests.get')
+    @patch.object(SESSION, 'get')
     def test_handle_css_content(self, mock_get, client):
         """Test handling CSS files"""
         mock_response = Mock()
         mock_response.status_code = 200
-        mock_response.content = b'body { color: red; }'
+        mock_response.raw.stream.return_value = iter([b'body { color: red; }'])
         mock_response.headers = {'content-type': 'text/css'}
         mock_get.return_value = mock_response
 
@@ -279,11 +351,171 @@ class TestContentTypes:
         # CSS should not be rewritten
         assert response.data == b'body { color: red; }'
 
+    @patch.object(SESSION, 'get')
+    def test_missing_content_type_is_not_sent_empty(self, mock_get, client):
+        """Test that a response without Content-Type gets the default one, not an empty header"""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.raw.stream.return_value = iter([b'data'])
+        mock_response.headers = {}
+        mock_get.return_value = mock_response
+
+        response = client.get('/w/load.php')
+
+        assert response.headers['Content-Type']
+        assert response.data == b'data'
+
+
+class TestCompression:
+    """Test gzip compression of rewritten HTML"""
+
+    def mock_html_response(self, mock_get, body):
+        """Make the mocked Wikipedia fetch return body as HTML"""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.content = body
+        mock_response.headers = {'content-type': 'text/html; charset=utf-8'}
+        mock_get.return_value = mock_response
+
+    @patch.object(SESSION, 'get')
+    def test_html_is_gzipped_when_accepted(self, mock_get, client):
+        """Test that large HTML responses are gzipped for clients that accept gzip"""
+        body = b'<html><body>' + b'<p>Paragraph</p>' * 200 + b'</body></html>'
+        self.mock_html_response(mock_get, body)
+
+        response = client.get('/w/index.php', headers={'Accept-Encoding': 'gzip, deflate, br'})
+
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert gzip.decompress(response.data) == body
+
+    @patch.object(SESSION, 'get')
+    def test_html_is_not_gzipped_when_refused(self, mock_get, client):
+        """Test that a zero quality for gzip is honoured as a refusal"""
+        body = b'<html><body>' + b'<p>Paragraph</p>' * 200 + b'</body></html>'
+        self.mock_html_response(mock_get, body)
+
+        response = client.get('/w/index.php', headers={'Accept-Encoding': 'gzip;q=0, identity'})
+
+        assert 'Content-Encoding' not in response.headers
+        assert response.data == body
+
+    @patch.object(SESSION, 'get')
+    def test_html_is_not_gzipped_without_accept_encoding(self, mock_get, client):
+        """Test that clients that don't accept gzip get the plain body"""
+        body = b'<html><body>' + b'<p>Paragraph</p>' * 200 + b'</body></html>'
+        self.mock_html_response(mock_get, body)
+
+        response = client.get('/w/index.php')
+
+        assert 'Content-Encoding' not in response.headers
+        assert response.data == body
+
+
+class TestPageCache:
+    """Test reuse of processed pages while Wikipedia's ETag is unchanged"""
+
+    @pytest.fixture
+    def page_cache_enabled(self, monkeypatch):
+        """Give the page cache a budget and start it empty"""
+        monkeypatch.setattr(page_cache, 'PAGE_CACHE_MAX_BYTES', 1024 * 1024)
+        page_cache.clear()
+        yield
+        page_cache.clear()
+
+    @patch('src.proxy.html_processing.process_page', return_value=(b'<p>Processed</p>', True))
+    @patch.object(SESSION, 'get')
+    def test_not_modified_serves_cached_page(self, mock_get, mock_process, client, page_cache_enabled):
+        """Test that a 304 revalidation reuses the processed page"""
+        first = Mock()
+        first.status_code = 200
+        first.content = b'<p>Original</p>'
+        first.headers = {'content-type': 'text/html', 'ETag': '"v1"', 'Cache-Control': 'max-age=60'}
+        not_modified = Mock()
+        not_modified.status_code = 304
+        not_modified.headers = {'ETag': '"v1"'}
+        mock_get.side_effect = [first, not_modified]
+
+        assert client.get('/wiki/Test').data == b'<p>Processed</p>'
+        response = client.get('/wiki/Test')
+
+        assert response.status_code == 200
+        assert response.data == b'<p>Processed</p>'
+        assert response.headers['Cache-Control'] == 'max-age=60'
+        assert mock_get.call_args[1]['headers']['If-None-Match'] == '"v1"'
+        mock_process.assert_called_once()
+
+    @patch('src.proxy.html_processing.process_page',
+           side_effect=[(b'<p>One</p>', True), (b'<p>Two</p>', True)])
+    @patch.object(SESSION, 'get')
+    def test_changed_page_is_processed_again(self, mock_get, mock_process, client, page_cache_enabled):
+        """Test that a new version of the page replaces the cached one"""
+        versions = []
+        for etag in ('"v1"', '"v2"'):
+            resp = Mock()
+            resp.status_code = 200
+            resp.content = b'<p>Original</p>'
+            resp.headers = {'content-type': 'text/html', 'ETag': etag}
+            versions.append(resp)
+        mock_get.side_effect = versions
+
+        client.get('/wiki/Test')
+        response = client.get('/wiki/Test')
+
+        assert response.data == b'<p>Two</p>'
+        assert page_cache.get('https://en.wikipedia.org/wiki/Test').etag == '"v2"'
+
+    @patch('src.proxy.html_processing.process_page', return_value=(b'<p>Partly rewritten</p>', False))
+    @patch.object(SESSION, 'get')
+    def test_page_with_failed_rewrites_is_not_cached(self, mock_get, mock_process, client, page_cache_enabled):
+        """Test that a page whose sections fell back to the originals is processed again next time"""
+        resp = Mock()
+        resp.status_code = 200
+        resp.content = b'<p>Original</p>'
+        resp.headers = {'content-type': 'text/html', 'ETag': '"v1"'}
+        mock_get.return_value = resp
+
+        client.get('/wiki/Test')
+        client.get('/wiki/Test')
+
+        assert page_cache.get('https://en.wikipedia.org/wiki/Test') is None
+        assert 'If-None-Match' not in mock_get.call_args[1]['headers']
+        assert mock_process.call_count == 2
+
+    def test_least_recently_used_page_is_evicted(self, monkeypatch):
+        """Test that the cache stays within its byte budget"""
+        monkeypatch.setattr(page_cache, 'PAGE_CACHE_MAX_BYTES', 10)
+        page_cache.clear()
+        for url in ('a', 'b', 'c'):
+            page_cache.put(url, page_cache.CachedPage('"e"', 'text/html', b'12345', {}))
+
+        assert page_cache.get('a') is None
+        assert page_cache.get('b') is not None
+        assert page_cache.get('c') is not None
+        page_cache.clear()
+
+
+class TestLogging:
+    """Test logging setup shared by the development server and gunicorn"""
+
+    def test_debug_sections_enables_section_logging(self, monkeypatch):
+        """Test that DEBUG_SECTIONS=true turns on html_processing's debug logs"""
+        monkeypatch.setenv('DEBUG_SECTIONS', 'true')
+        level = html_processing.logger.level
+        try:
+            # basicConfig would leave a stderr handler on the root logger for later tests
+            with patch('logging.basicConfig') as mock_basic_config:
+                configure_logging()
+            mock_basic_config.assert_called_once()
+            assert html_processing.logger.isEnabledFor(logging.DEBUG)
+        finally:
+            html_processing.logger.setLevel(level)
+
 
 class TestURLRewritingIntegration:
     """Test URL rewriting in integration with proxy"""
 
-    @patch('src.proxy.requests.get')
+    @patch.object(SESSION, 'get')
     def test_rewritten_urls_in_proxied_content(self, mock_get, client):
         """Test that URLs in proxied HTML are correctly rewritten"""
         html_with_links = '''
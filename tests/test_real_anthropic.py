@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Tests against the real Anthropic SDK client (skipped unless an API key is set)
+
+Kept out of test_llm_integration.py so the common runs never import the SDK
+just to skip these.
+"""
+
+import os
+import asyncio
+import pytest
+from src import response_cache
+
+
+requires_api_key = pytest.mark.skipif(
+    not os.getenv('ANTHROPIC_API_KEY') or os.getenv('ANTHROPIC_API_KEY') == 'test-api-key-123',
+    reason="Real Anthropic API key not provided"
+)
+
+
+class TestRealAnthropicClient:
+    """Tests with real Anthropic client (skipped if no API key)"""
+
+    @requires_api_key
+    def test_real_client_initialization(self, monkeypatch, llm_module):
+        """Test that the singleton client is a real AsyncAnthropic using the key"""
+        from anthropic import AsyncAnthropic
+        llm = llm_module
+        llm.configure()
+        monkeypatch.setattr(llm, '_async_client', None)
+
+        client = llm.get_async_client()
+
+        assert isinstance(client, AsyncAnthropic)
+        assert client.api_key == os.getenv('ANTHROPIC_API_KEY')
+        asyncio.run(llm.close_async_client())
+
+    @requires_api_key
+    def test_real_client_basic_call(self, monkeypatch, llm_module):
+        """Test one minimal rewrite through the real API"""
+        llm = llm_module
+        llm.configure()
+        monkeypatch.setattr(llm, '_async_client', None)
+        monkeypatch.setattr(response_cache, 'RESPONSE_CACHE_PATH', '')
+
+        async def rewrite_once():
+            # The client's connections belong to this loop, so close it here
+            try:
+                return await llm.rewrite_content('<p>The cat sat on the mat.</p>')
+            finally:
+                await llm.close_async_client()
+
+        result = asyncio.run(rewrite_once())
+
+        assert isinstance(result, str)
+        assert result.strip()
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the SQLite response cache and its use in rewrite_content
+"""
+
+import asyncio
+import sqlite3
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+from src import llm, response_cache
+
+
+class TestResponseCache:
+    """Test cache storage and expiry"""
+
+    def test_disabled_without_path(self, monkeypatch):
+        """Test that caching is off unless a database path is configured"""
+        monkeypatch.setattr(response_cache, 'RESPONSE_CACHE_PATH', '')
+        assert not response_cache.is_enabled()
+
+    def test_put_then_get(self, cache_path):
+        """Test that stored values are returned by key"""
+        response_cache.put_sync('key', '<p>cached</p>')
+        assert response_cache.get_sync('key') == '<p>cached</p>'
+        assert response_cache.get_sync('other') is None
+
+    def test_expired_entries_are_ignored(self, cache_path):
+        """Test that entries past their TTL are treated as misses"""
+        response_cache.put_sync('key', '<p>old</p>', ttl=-1)
+        assert response_cache.get_sync('key') is None
+
+    def test_key_depends_on_every_part(self):
+        """Test that keys differ when any part differs"""
+        assert response_cache.make_key('a', 'b') == response_cache.make_key('a', 'b')
+        assert response_cache.make_key('a', 'b') != response_cache.make_key('ab', '')
+
+
+class TestRewriteContentCaching:
+    """Test that rewrite_content only calls Claude on cache misses"""
+
+    @patch.object(llm, 'generate_rewrite', new_callable=AsyncMock, return_value='<p>rewritten</p>')
+    def test_second_call_is_served_from_cache(self, mock_generate, cache_path):
+        """Test that identical content is only rewritten once"""
+        first = asyncio.run(llm.rewrite_content('<p>same</p>'))
+        second = asyncio.run(llm.rewrite_content('<p>same</p>'))
+
+        assert first == second == '<p>rewritten</p>'
+        mock_generate.assert_awaited_once()
+
+    @patch.object(llm, 'generate_rewrite', new_callable=AsyncMock, return_value='<p>rewritten</p>')
+    def test_no_cache_when_disabled(self, mock_generate, monkeypatch):
+        """Test that every call reaches Claude when caching is disabled"""
+        monkeypatch.setattr(response_cache, 'RESPONSE_CACHE_PATH', '')
+        asyncio.run(llm.rewrite_content('<p>same</p>'))
+        asyncio.run(llm.rewrite_content('<p>same</p>'))
+
+        assert mock_generate.await_count == 2
+
+    def test_concurrent_duplicates_share_one_call(self, monkeypatch):
+        """Test that identical in-flight rewrites are coalesced into one Claude call"""
+        monkeypatch.setattr(response_cache, 'RESPONSE_CACHE_PATH', '')
+
+        async def slow_generate(html_content, num_sections=1):
+            await asyncio.sleep(0.01)
+            return '<p>rewritten</p>'
+
+        async def rewrite_many():
+            return await asyncio.gather(
+                *(llm.rewrite_content('<p>same</p>') for _ in range(5)),
+                llm.rewrite_content('<p>other</p>')
+            )
+
+        with patch.object(llm, 'generate_rewrite', new_callable=AsyncMock,
+                          side_effect=slow_generate) as mock_generate:
+            results = asyncio.run(rewrite_many())
+
+        assert results == ['<p>rewritten</p>'] * 6
+        assert mock_generate.await_count == 2
+
+    def test_truncated_reply_is_not_cached(self, cache_path):
+        """Test that a reply cut off at max_tokens fails instead of being cached"""
+        client = MagicMock()
+        client.messages.create = AsyncMock(return_value=SimpleNamespace(
+            content=[SimpleNamespace(text='<p>cut of')],
+            stop_reason='max_tokens',
+            usage=SimpleNamespace(input_tokens=10)
+        ))
+
+        with patch.object(llm, 'get_async_client', return_value=client), \
+                patch.object(llm, 'USE_STREAMING', False):
+            with pytest.raises(Exception, match='max_tokens'):
+                asyncio.run(llm.rewrite_content('<p>same</p>'))
+
+        assert response_cache.get_sync(llm.make_cache_key('<p>same</p>')) is None
+
+    @patch.object(llm, 'generate_rewrite', new_callable=AsyncMock, return_value='<p>rewritten</p>')
+    def test_cache_write_failure_keeps_rewrite(self, mock_generate, cache_path, caplog):
+        """Test that a failed cache write is logged and the rewrite still returned"""
+        with patch.object(response_cache, 'put_sync',
+                          side_effect=sqlite3.OperationalError('database is locked')):
+            result = asyncio.run(llm.rewrite_content('<p>same</p>'))
+
+        assert result == '<p>rewritten</p>'
+        assert 'database is locked' in caplog.text
+
+    def test_database_uses_wal(self, cache_path):
+        """Test that the cache database allows concurrent readers across processes"""
+        with response_cache._lock:
+            mode = response_cache.get_connection().execute("PRAGMA journal_mode").fetchone()[0]
+
+        assert mode == 'wal'
+
+
+class AsyncResults:
+    """Async iterator standing in for the batch results stream"""
+
+    def __init__(self, entries):
+        self.entries = iter(entries)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.entries)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+def batch_entry(custom_id, text=None):
+    """Build a batch result entry; entries without text are errored requests"""
+    if text is None:
+        return SimpleNamespace(custom_id=custom_id, result=SimpleNamespace(type='errored'))
+    message = SimpleNamespace(content=[SimpleNamespace(text=text)], stop_reason='end_turn')
+    return SimpleNamespace(custom_id=custom_id, result=SimpleNamespace(type='succeeded', message=message))
+
+
+class TestRewriteContentBatch:
+    """Test bulk rewriting through the Message Batches API"""
+
+    def test_results_are_ordered_and_cached(self, cache_path):
+        """Test that out-of-order results map back to inputs and warm the cache"""
+        client = MagicMock()
+        client.messages.batches.create = AsyncMock(
+            return_value=SimpleNamespace(id='batch_1', processing_status='in_progress')
+        )
+        client.messages.batches.retrieve = AsyncMock(
+            return_value=SimpleNamespace(id='batch_1', processing_status='ended')
+        )
+        client.messages.batches.results = AsyncMock(return_value=AsyncResults([
+            batch_entry('2', '<p>C</p>'), batch_entry('0', '<p>A</p>'), batch_entry('1'),
+        ]))
+
+        with patch.object(llm, 'get_async_client', return_value=client), \
+                patch.object(llm, 'BATCH_POLL_INTERVAL', 0):
+            results = asyncio.run(llm.rewrite_content_batch(['<p>a</p>', '<p>b</p>', '<p>c</p>']))
+
+        assert results == ['<p>A</p>', None, '<p>C</p>']
+        requests = client.messages.batches.create.call_args.kwargs['requests']
+        assert [request['custom_id'] for request in requests] == ['0', '1', '2']
+        assert response_cache.get_sync(llm.make_cache_key('<p>a</p>')) == '<p>A</p>'
+        assert response_cache.get_sync(llm.make_cache_key('<p>b</p>')) is None
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
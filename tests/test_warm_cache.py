@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the response cache warmer
+"""
+
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+import pytest
+from src import llm, response_cache, warm_cache
+from tests.test_response_cache import AsyncResults, batch_entry
+
+
+def mock_batch_client(entries):
+    """Build a client whose Message Batch has already ended with the given entries"""
+    client = MagicMock()
+    client.messages.batches.create = AsyncMock(
+        return_value=SimpleNamespace(id='batch_1', processing_status='ended')
+    )
+    client.messages.batches.results = AsyncMock(return_value=AsyncResults(entries))
+    return client
+
+
+class TestWarmCache:
+    """Test that the warmer only submits rewrites that aren't cached yet"""
+
+    def test_requires_cache_path(self, monkeypatch):
+        """Test that warming is refused when there is no cache to warm"""
+        monkeypatch.setattr(response_cache, 'RESPONSE_CACHE_PATH', '')
+        assert warm_cache.main(['Test']) == 1
+
+    @patch('src.warm_cache.fetch_article', return_value=b'<html></html>')
+    @patch('src.warm_cache.html_processing.collect_rewrite_requests',
+           return_value=[('<p>cached</p>', 1), ('<p>new</p>', 1), ('<p>new</p>', 1)])
+    def test_cached_and_duplicate_requests_are_skipped(self, mock_collect, mock_fetch, cache_path):
+        """Test that only uncached, distinct requests are sent and their results stored"""
+        response_cache.put_sync(llm.make_cache_key('<p>cached</p>'), '<p>CACHED</p>')
+        client = mock_batch_client([batch_entry('0', '<p>NEW</p>')])
+
+        with patch.object(llm, 'get_async_client', return_value=client):
+            assert warm_cache.main(['Test']) == 0
+
+        requests = client.messages.batches.create.call_args.kwargs['requests']
+        assert len(requests) == 1
+        assert requests[0]['params']['messages'][0]['content'].endswith('<p>new</p>')
+        assert response_cache.get_sync(llm.make_cache_key('<p>new</p>')) == '<p>NEW</p>'
+
+    @patch('src.warm_cache.fetch_article', return_value=b'<html></html>')
+    @patch('src.warm_cache.html_processing.collect_rewrite_requests',
+           return_value=[('<p>cached</p>', 1)])
+    def test_nothing_submitted_when_all_cached(self, mock_collect, mock_fetch, cache_path):
+        """Test that a fully cached article doesn't create a batch"""
+        response_cache.put_sync(llm.make_cache_key('<p>cached</p>'), '<p>CACHED</p>')
+        client = mock_batch_client([])
+
+        with patch.object(llm, 'get_async_client', return_value=client):
+            assert warm_cache.main(['Test']) == 0
+
+        client.messages.batches.create.assert_not_called()
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])